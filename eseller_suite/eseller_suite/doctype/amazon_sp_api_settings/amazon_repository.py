@@ -4,7 +4,9 @@
 
 import json
 import time, random
+import threading
 import urllib.parse
+from dataclasses import dataclass
 
 import dateutil
 import frappe
@@ -24,6 +26,7 @@ from frappe import scrub
 from frappe.utils import getdate, add_days, get_datetime, nowdate, today
 from requests.exceptions import HTTPError
 from requests.exceptions import RequestException
+from requests.adapters import HTTPAdapter
 
 try:
     # v14 / v15 (current)
@@ -51,6 +54,13 @@ SP_DOMAIN  = "sellingpartnerapi-na.amazon.com"
 SPAPI_CONNECT_TIMEOUT = 12.0   # time to establish connection
 SPAPI_READ_TIMEOUT    = 45.0   # time to read response body (orderItems/finances can be slow)
 SPAPI_TIMEOUT         = (SPAPI_CONNECT_TIMEOUT, SPAPI_READ_TIMEOUT)
+SPAPI_MAX_BACKOFF     = 60.0   # cap for exponential backoff on throttling / 5xx
+
+# Shared keep-alive session so paginated calls reuse the TLS connection to
+# SP_DOMAIN instead of handshaking on every page. Retries stay in the
+# _sp_get loop (it honours Retry-After and logs), so the adapter doesn't retry.
+_HTTP = requests.Session()
+_HTTP.mount("https://", HTTPAdapter(pool_connections=8, pool_maxsize=16, max_retries=0))
 
 def _get_lwa_token(settings):
     if AmazonRepository._token and time.time() < AmazonRepository._token_expires:
@@ -74,13 +84,14 @@ def _get_lwa_token(settings):
                 raise  # Re-raise after retries exhausted
             time.sleep((2 ** attempt) + random.random())  # Exponential backoff + jitter
 
-def _sp_get(path, query, settings, rdt=None, max_retry: int = 10, return_full: bool = False):
+def _sp_get(path, query, settings, rdt=None, max_retry: int = 10, return_full: bool = False, access_token=None):
     """
     Low-level GET helper (no SDK, no SigV4 – good enough for
     non-restricted GET endpoints such as /reports/…).
     - `query` can now be **dict OR str**.
     - 403 message is generic (reports:* OR finances:*).
     - Added `return_full` param: If True, returns full response JSON (e.g., for endpoints with top-level 'pagination').
+    - `access_token`: an LWA token fetched by the caller; no token lookup (and so no DB read) is made here.
     """
     # ――― 1.  build URL ------------------------------------------------
     if isinstance(query, dict):
@@ -93,8 +104,7 @@ def _sp_get(path, query, settings, rdt=None, max_retry: int = 10, return_full: b
     timeout = SPAPI_TIMEOUT
 
     # ――― 2.  common headers ------------------------------------------
-    token = _get_lwa_token(settings)
-    access_token = rdt if rdt else token  # Use RDT if provided, else LWA
+    access_token = rdt or access_token or _get_lwa_token(settings)  # Use RDT if provided, else LWA
     headers = {
         "host": SP_DOMAIN,
         "user-agent": "ERPNext-eSellerSuite/1.0",
@@ -105,7 +115,7 @@ def _sp_get(path, query, settings, rdt=None, max_retry: int = 10, return_full: b
     # ――― 3.  retry / throttle loop -----------------------------------
     for attempt in range(max_retry):
         try:
-            resp = requests.get(url, headers=headers, timeout=timeout)
+            resp = _HTTP.get(url, headers=headers, timeout=timeout)
         except requests.exceptions.RequestException as e:
             # More informative logging + smarter backoff for the exact failure you hit
             is_network_stall = isinstance(e, (requests.exceptions.Timeout, requests.exceptions.ConnectionError))
@@ -137,7 +147,8 @@ def _sp_get(path, query, settings, rdt=None, max_retry: int = 10, return_full: b
             frappe.logger().error(f"SP-API {resp.status_code} for {url}\n{resp.text[:500]}")
             resp.raise_for_status()
 
-        retry_after = int(resp.headers.get("Retry-After", 0)) or (2 + attempt)
+        # Honour Retry-After; otherwise back off exponentially instead of linearly
+        retry_after = parse_rate_limit(resp.headers).retry_after or min(2 ** attempt, SPAPI_MAX_BACKOFF)
         frappe.logger().info(f"SP-API {resp.status_code}, sleeping {retry_after}s for {path}")
         time.sleep(retry_after + random.random())
 
@@ -235,6 +246,7 @@ def _list_orders(
     """
     Thin wrapper around GET /orders/v0/orders.
     Mirrors the kwargs you used with the SDK.
+    Returns a `(payload, RateLimit)` tuple so callers can pace pagination.
     """
 
     if next_token:
@@ -257,7 +269,10 @@ def _list_orders(
         if amazon_order_ids:
             qs["AmazonOrderIds"] = amazon_order_ids        
         query = urllib.parse.urlencode(qs, safe=",")
-    return _sp_get("/orders/v0/orders", query, settings)
+    data = _sp_get("/orders/v0/orders", query, settings, return_full=True)
+    # Headers live on the full response; the payload alone would drop them
+    rate_limit = parse_rate_limit(data.get("__headers__") or {})
+    return data.get("payload", data), rate_limit
 
 def _list_order_items(settings, amazon_order_id, next_token=None):
     path  = f"/orders/v0/orders/{amazon_order_id}/orderItems"
@@ -273,10 +288,61 @@ def _list_financial_events(settings, amazon_order_id, next_token=None):
     query = f"NextToken={urllib.parse.quote(next_token, safe='')}" if next_token else ""
     return _sp_get(path, query, settings)
 
-def _page_pause(resp_headers, floor=2.0):
-    retry = float(resp_headers.get("Retry-After", 0) or 0)
-    time.sleep(max(retry, floor) + random.random())
-    
+@dataclass(frozen=True)
+class RateLimit:
+    """Rate-limit info parsed once from an SP-API response."""
+    remaining: float | None  # x-amzn-RateLimit-Remaining, when Amazon sends it
+    limit: float | None      # x-amzn-RateLimit-Limit, sustained requests per second
+    retry_after: float       # Retry-After, seconds
+
+def parse_rate_limit(resp_headers) -> RateLimit:
+    def _header(name):
+        value = resp_headers.get(name)
+        return _to_float(value, None) if value not in (None, "") else None
+
+    return RateLimit(
+        remaining=_header("x-amzn-RateLimit-Remaining"),
+        limit=_header("x-amzn-RateLimit-Limit"),
+        retry_after=_header("Retry-After") or 0.0,
+    )
+
+class RequestPacer:
+    """
+    Thread-safe token bucket, shareable between worker threads. Up to `burst`
+    requests go out back to back; after that, tokens refill at `rate` per second
+    and a caller only sleeps when the bucket is empty. The rate starts at the
+    operation's documented rate and follows x-amzn-RateLimit-Limit once Amazon
+    reports it; a Retry-After on a response holds the next request back at least
+    that long. 429s are retried with backoff inside _sp_get.
+    """
+    JITTER = 0.1  # seconds; keeps workers from firing in lockstep
+    def __init__(self, rate: float = 2.0, burst: int = 2):  # defaults: getInventorySummaries, 2 req/s with a burst of 2
+        self.rate = rate
+        self.burst = burst
+        self._lock = threading.Lock()
+        self._tokens = float(burst)
+        self._last = time.monotonic()
+        self._hold_until = 0.0
+
+    def wait(self):
+        # Take a token under the lock (going negative reserves a future slot), sleep outside it
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._last) * self.rate)
+            self._last = now
+            self._tokens -= 1
+            delay = -self._tokens / self.rate if self._tokens < 0 else 0
+            delay = max(delay, self._hold_until - now)
+        if delay > 0:
+            time.sleep(delay + random.random() * self.JITTER)
+
+    def update(self, rate_limit):
+        with self._lock:
+            if rate_limit.limit:
+                self.rate = rate_limit.limit
+            if rate_limit.retry_after:
+                self._hold_until = max(self._hold_until, time.monotonic() + rate_limit.retry_after)
+
 def _create_restricted_data_token(settings, order_id, max_retry: int = 10):
     """
     POST /tokens/2021-03-01/restrictedDataToken to get RDT for PII access.
@@ -306,7 +372,7 @@ def _create_restricted_data_token(settings, order_id, max_retry: int = 10):
 
     for attempt in range(max_retry):
         try:
-            resp = requests.post(url, headers=headers, json=body, timeout=SPAPI_TIMEOUT)
+            resp = _HTTP.post(url, headers=headers, json=body, timeout=SPAPI_TIMEOUT)
         except RequestException as e:
             frappe.logger().warning(f"Amazon SP-API endpoint network error (Restricted Data Token) on attempt {attempt+1}/{max_retry} for order {order_id}: {e}")
             time.sleep(2 + attempt)
@@ -1328,31 +1394,48 @@ class AmazonRepository:
 
         return so.name
 
-    def _fetch_and_process_orders(self, statuses, channel, last_updated_after, last_updated_before, sales_orders):
+    def _fetch_and_process_orders(self, statuses_by_channel, last_updated_after, last_updated_before, sales_orders):
+        """
+        Fetch every channel in one paginated getOrders call.
+        `statuses_by_channel` maps a FulfillmentChannel to the OrderStatuses wanted for it,
+        e.g. {"AFN": ["Shipped"], "MFN": ["Unshipped"]}.
+        """
+        channels = ",".join(statuses_by_channel)
+        all_statuses = []
+        for statuses in statuses_by_channel.values():
+            all_statuses += [status for status in statuses if status not in all_statuses]
+
+        # getOrders allows 0.0167 req/s sustained with a burst of 20. The bucket spends
+        # the burst first, so most runs never wait a full minute between pages.
+        pacer = RequestPacer(rate=0.0167, burst=20)
+
         # ── first fetch ──────────────────────────────────────────────────
-        orders_payload = _list_orders(
+        pacer.wait()
+        orders_payload, rate_limit = _list_orders(
             self.amz_setting,
             updated_after=last_updated_after,
             updated_before=last_updated_before,
-            order_statuses=",".join(statuses),
-            fulfillment_channels=channel,  # Note: Pass as str, not list (e.g., "AFN")
+            order_statuses=",".join(all_statuses),
+            fulfillment_channels=channels,  # Note: Pass as str, not list (e.g., "AFN,MFN")
             max_results=50,
         )
 
         #print(f"Orders Payload: {orders_payload}", flush=True)
 
         # ── pagination loop ─────────────────────────────────────────────
-        while True:
-            if not orders_payload:
-                break
-
-            orders_list = orders_payload.get("Orders")
+        while orders_payload:
+            orders_list = orders_payload.get("Orders") or []
             next_token = orders_payload.get("NextToken")
 
             if not orders_list:
                 break
 
             for order in orders_list:
+                # The fused call returns the union of statuses; keep only the pairs
+                # each channel asked for (e.g. MFN "Shipped" is not wanted)
+                channel = (order.get("FulfillmentChannel") or "").upper()
+                if order.get("OrderStatus") not in statuses_by_channel.get(channel, ()):
+                    continue
                 so = self.create_sales_order(order)
                 time.sleep(1.1)
                 if so:
@@ -1362,12 +1445,13 @@ class AmazonRepository:
                 break
 
             # ── throttle between pages ─────────────────────────────
-            _page_pause(orders_payload.get("__headers__", {}))
+            pacer.update(rate_limit)
+            pacer.wait()  # waits for a token or Retry-After, whichever is later
 
             try:
-                orders_payload = _list_orders(self.amz_setting, next_token=next_token)
+                orders_payload, rate_limit = _list_orders(self.amz_setting, next_token=next_token)
             except HTTPError as e:
-                frappe.logger().warning(f"Stopped pagination (throttle) for {channel}: {e}")
+                frappe.logger().warning(f"Stopped pagination (throttle) for {channels}: {e}")
                 break
 
     def get_orders(self, last_updated_after, sync_selected_date_only=0) -> list:
@@ -1401,11 +1485,10 @@ class AmazonRepository:
             
         sales_orders = []
         
-        # Fetch AFN orders
-        self._fetch_and_process_orders(afn_statuses, "AFN", created_after, last_updated_before, sales_orders)
-
-        # Fetch MFN orders
-        self._fetch_and_process_orders(mfn_statuses, "MFN", created_after, last_updated_before, sales_orders)
+        # Fetch AFN and MFN orders in a single paginated call
+        statuses_by_channel = {"AFN": afn_statuses, "MFN": mfn_statuses}
+        statuses_by_channel = {ch: statuses_by_channel[ch] for ch in fulfillment_channels}
+        self._fetch_and_process_orders(statuses_by_channel, created_after, last_updated_before, sales_orders)
 
         frappe.enqueue("eseller_suite.eseller_suite.doctype.amazon_sp_api_settings.amazon_sp_api_settings.enq_si_submit", sales_orders=sales_orders)
         
@@ -1454,7 +1537,7 @@ def reprocess_single_draft_order(amz_setting_name: str, sales_order_name: str, a
     try:
         print(f"[{amazon_order_id}] Processing single draft SO {sales_order_name}", flush=True)
 
-        order_payload = _list_orders(ar.amz_setting, amazon_order_ids=amazon_order_id)
+        order_payload, _rate_limit = _list_orders(ar.amz_setting, amazon_order_ids=amazon_order_id)
         if not order_payload or not order_payload.get("Orders"):
             print(f"[{amazon_order_id}] No order payload found. Deleting orphan SO {sales_order_name}.")
             frappe.delete_doc("Sales Order", sales_order_name, ignore_permissions=True)
@@ -2,7 +2,7 @@
 # For license information, please see license.txt
 #/apps/eseller_suite/eseller_suite/eseller_suite/doctype/amazon_sp_api_settings
 
-from datetime import datetime, timedelta
+from datetime import date, timedelta
 
 import frappe
 from frappe import _
@@ -30,9 +30,9 @@ class AmazonSPAPISettings(Document):
         #     self.db_set("is_old_data_migrated", 1)
 
     def validate_after_date(self):
-        if datetime.strptime(add_days(today(), -60), "%Y-%m-%d") > datetime.strptime(
-            get_date_str(self.after_date), "%Y-%m-%d"
-        ):
+        # fromisoformat is C-implemented and much cheaper than strptime
+        min_after_date = date.fromisoformat(add_days(today(), -60))
+        if min_after_date > date.fromisoformat(get_date_str(self.after_date)):
             frappe.throw(_("The date must be within the last 60 days."))
 
     @frappe.whitelist()
@@ -188,7 +188,13 @@ def enq_si_submit(sales_orders = []):
     if not sales_orders:
         sales_invoices = frappe.db.get_all("Sales Invoice", {"docstatus":0, "amazon_order_id":["is", "set"]}, pluck="name")
     else:
-        sales_invoices = frappe.db.get_all("Sales Invoice Item", {"sales_order":["in", sales_orders]}, pluck="parent")
+        # One row per draft invoice (the item table would repeat the parent per line)
+        sales_invoices = frappe.db.sql("""
+            SELECT DISTINCT sii.parent
+            FROM `tabSales Invoice Item` sii
+            INNER JOIN `tabSales Invoice` si ON si.name = sii.parent
+            WHERE sii.sales_order IN %(sales_orders)s AND si.docstatus = 0
+        """, {"sales_orders": tuple(sales_orders)}, pluck=True)
     for sales_invoice in sales_invoices:
         sales_invoice = frappe.get_doc("Sales Invoice", sales_invoice)
         if sales_invoice.docstatus in [1, 2]:
@@ -1,597 +1,896 @@
-# amazon_sync_fba_inventory.py
-# =========================================
-#  Syncs Amazon FBA inventory quantities to ERPNext once per day
-#  using the FBA Inventory API (direct GET, no reports/POST needed).
-# =========================================
-from __future__ import annotations
-import json, requests
-
-from datetime import datetime, timedelta, timezone
-import time
-from zoneinfo import ZoneInfo
-import frappe
-from .amazon_repository import _sp_get, AmazonRepository
-
-from urllib.parse import urlencode
-
-from collections import defaultdict
-
-from erpnext.stock.doctype.batch.batch import get_batch_qty
-from erpnext.stock.stock_ledger import NegativeStockError
-
-import pytz
-
-# When True all docs are left as drafts and not submitted
-DEBUG = False  # Toggle to False to disable all debug prints. Also set to True to run the progam on demand as opposed to during the set time
-
-# Belt-and-suspenders guard: if a single sync run would zero out more than this
-# fraction of the Amazon-linked items currently holding stock in a warehouse,
-# treat the API pull as partial/unhealthy and SKIP the zero-out for that warehouse
-# (reported adjustments still apply). Prevents a truncated response from wiping stock.
-MAX_ZERO_OUT_FRACTION = 0.10  # tune to your catalog's normal daily sell-through-to-zero rate
-
-# ──────────────────────────────────────────
-# Helper Functions
-# ──────────────────────────────────────────
-def parse_marketplaces(mkt_str: str) -> list[str]:
-    if not mkt_str:
-        return []
-    return [m.strip() for m in mkt_str.split(',') if m.strip()]
-
-# ──────────────────────────────────────────
-# Inbound Processing
-# ──────────────────────────────────────────
-def process_inbound_inventory(asin_inbound, settings):
-    prep_wh = settings.custom_amazon_fba_staging_area
-    inbound_wh = settings.custom_amazon_inbound_warehouse
-    company = settings.company
-    adjustment_account = settings.custom_amazon_inventory_adjustment_account
-
-    if DEBUG: print(f"[DEBUG] Starting inbound inventory processing for warehouse: {inbound_wh}")
-
-    # First pass: collect transfers for increases
-    transfer_items = []
-    prep_reconcile_items = []
-    transfer_pending = []
-    for asin, target_qty in asin_inbound.items():
-        if DEBUG: print(f"[DEBUG] Processing inbound ASIN: {asin} with target_qty: {target_qty}")
-        item_code = frappe.db.get_value("Item", {"custom_asin": asin, "disabled": 0}, "name")
-        if not item_code:
-            if DEBUG: print(f"[DEBUG] No matching item_code found for ASIN: {asin}")
-            continue
-
-        # ADDED: Skip if not a stock item
-        if not frappe.get_value("Item", item_code, "is_stock_item"):
-            if DEBUG: print(f"[DEBUG] Skipping non-stock item: {item_code}")
-            continue
-
-        current_inbound = frappe.db.get_value("Bin", {"item_code": item_code, "warehouse": inbound_wh}, "actual_qty") or 0
-        diff = target_qty - current_inbound
-        if DEBUG: print(f"[DEBUG] Current inbound qty: {current_inbound}, diff: {diff}")
-        if diff <= 0:
-            continue
-
-        current_prep = frappe.db.get_value("Bin", {"item_code": item_code, "warehouse": prep_wh}, "actual_qty") or 0
-        transfer_qty = min(current_prep, diff)
-        if DEBUG: print(f"[DEBUG] Current prep qty: {current_prep}, transfer_qty: {transfer_qty}")
-        if transfer_qty <= 0:
-            continue
-
-        bin_data_prep = frappe.db.get_value(
-            "Bin",
-            {"item_code": item_code, "warehouse": prep_wh},
-            ["valuation_rate"],
-            as_dict=True
-        ) or {}
-        bin_rate = bin_data_prep.get("valuation_rate", 0)
-
-        item_valuation_rate = frappe.get_value("Item", item_code, "valuation_rate") or 0
-        val_rate = item_valuation_rate if item_valuation_rate > 0 else 0.01
-
-        has_batch = frappe.get_value("Item", item_code, "has_batch_no")
-        has_serial = frappe.get_value("Item", item_code, "has_serial_no")
-
-        reconcile_needed = (bin_rate != val_rate)
-
-        if reconcile_needed:
-            item_reconcile_items = []
-            if has_serial:
-                serial_nos = frappe.db.sql_list("""SELECT name FROM `tabSerial No` WHERE item_code = %s AND warehouse = %s""", (item_code, prep_wh))
-                if len(serial_nos) == current_prep:
-                    item_reconcile_items.append({
-                        "item_code": item_code,
-                        "warehouse": prep_wh,
-                        "qty": current_prep,
-                        "valuation_rate": val_rate,
-                        "serial_no": '\n'.join(serial_nos),
-                    })
-            elif has_batch:
-                batches = frappe.get_all("Batch", filters={"item": item_code}, fields=["name"])
-                for batch in batches:
-                    batch_qty = get_batch_qty(batch.name, prep_wh, item_code) or 0
-                    if batch_qty > 0:
-                        item_reconcile_items.append({
-                            "item_code": item_code,
-                            "warehouse": prep_wh,
-                            "qty": batch_qty,
-                            "valuation_rate": val_rate,
-                            "batch_no": batch.name,
-                        })
-            else:
-                item_reconcile_items.append({
-                    "item_code": item_code,
-                    "warehouse": prep_wh,
-                    "qty": current_prep,
-                    "valuation_rate": val_rate,
-                })
-            if item_reconcile_items:
-                prep_reconcile_items += item_reconcile_items
-                transfer_pending.append((item_code, transfer_qty, has_batch, has_serial, val_rate))
-            else:
-                if DEBUG: print(f"[DEBUG] Could not create reconcile items for {item_code}, skipping transfer")
-        else:
-            transfer_pending.append((item_code, transfer_qty, has_batch, has_serial, val_rate))
-
-    # Create and submit Prep Stock Reconciliation if needed
-    if prep_reconcile_items:
-        if DEBUG: print(f"[DEBUG] Creating Prep Stock Reconciliation with {len(prep_reconcile_items)} items...")
-        try:  # ADDED: Wrap for error logging
-            prep_sr = frappe.get_doc({
-                "doctype": "Stock Reconciliation",
-                "company": company,
-                "posting_date": frappe.utils.today(),
-                "purpose": "Stock Reconciliation",
-                "expense_account": adjustment_account,
-                "items": prep_reconcile_items,
-            })
-            prep_sr.insert(ignore_permissions=True)
-            if DEBUG: print(f"[DEBUG] Inserted Prep SR: {prep_sr.name}")
-            if DEBUG:
-                if DEBUG: print(f"[DEBUG] DEBUG mode: leaving Prep SR {prep_sr.name} as DRAFT (not submitted)")
-                frappe.db.commit()  # persist draft
-            else:
-                prep_sr.submit()
-                frappe.db.commit()
-                if DEBUG: print(f"[DEBUG] Submitted Prep SR: {prep_sr.name}")
-        except Exception:
-            frappe.log_error(frappe.get_traceback(), "Prep Stock Reconciliation Error")
-            raise  # Re-raise to propagate if needed
-
-    # Now process pending transfers
-    for item_code, transfer_qty, has_batch, has_serial, val_rate in transfer_pending:
-        current_prep = frappe.db.get_value("Bin", {"item_code": item_code, "warehouse": prep_wh}, "actual_qty") or 0
-        transfer_qty = min(current_prep, transfer_qty)
-        if transfer_qty <= 0:
-            continue
-        if has_serial:
-            serial_nos = frappe.db.sql_list("""SELECT name FROM `tabSerial No` WHERE item_code = %s AND warehouse = %s LIMIT %s""", (item_code, prep_wh, transfer_qty))
-            if len(serial_nos) == transfer_qty:
-                transfer_items.append({
-                    "item_code": item_code,
-                    "s_warehouse": prep_wh,
-                    "t_warehouse": inbound_wh,
-                    "qty": transfer_qty,
-                    "basic_rate": val_rate,
-                    "serial_no": '\n'.join(serial_nos),
-                })
-            else:
-                if DEBUG: print(f"[DEBUG] Insufficient serial nos for {item_code}, skipping transfer")
-        elif has_batch:
-            batches = frappe.get_all("Batch", filters={"item": item_code}, fields=["name"], order_by="creation asc")
-            remaining = transfer_qty
-            for batch in batches:
-                if remaining <= 0:
-                    break
-                batch_qty = get_batch_qty(batch.name, prep_wh, item_code) or 0
-                if batch_qty > 0:
-                    move_qty = min(batch_qty, remaining)
-                    transfer_items.append({
-                        "item_code": item_code,
-                        "s_warehouse": prep_wh,
-                        "t_warehouse": inbound_wh,
-                        "qty": move_qty,
-                        "basic_rate": val_rate,
-                        "batch_no": batch.name,
-                    })
-                    remaining -= move_qty
-            if remaining > 0:
-                if DEBUG: print(f"[DEBUG] Insufficient batch qty for {item_code}, transferred {transfer_qty - remaining}, remaining {remaining} will be handled by reconciliation")
-        else:
-            transfer_items.append({
-                "item_code": item_code,
-                "s_warehouse": prep_wh,
-                "t_warehouse": inbound_wh,
-                "qty": transfer_qty,
-                "basic_rate": val_rate,
-            })
-
-    # Create and submit Stock Entry if needed
-    if transfer_items:
-        if DEBUG: print(f"[DEBUG] Creating Stock Entry with {len(transfer_items)} items...")
-        se = frappe.get_doc({
-            "doctype": "Stock Entry",
-            "company": company,
-            "stock_entry_type": "Material Transfer",
-            "from_warehouse": prep_wh,
-            "to_warehouse": inbound_wh,
-            "posting_date": frappe.utils.today(),
-            "items": transfer_items,
-        })
-        se.insert(ignore_permissions=True)
-        if DEBUG: print(f"[DEBUG] Inserted SE: {se.name}")
-        try:
-            if DEBUG:
-                print(f"[DEBUG] DEBUG mode: leaving SE {se.name} as DRAFT (not submitted)")
-                frappe.db.commit()
-            else:
-                se.submit()
-                frappe.db.commit()
-                if DEBUG: print(f"[DEBUG] Submitted SE: {se.name}")
-        except NegativeStockError as e:
-            if DEBUG: print(f"[DEBUG] NegativeStockError during submit: {str(e)}")
-            # Safely delete draft
-            try:
-                se.reload()  # Reload to get current status
-                if se.docstatus == 0:
-                    se.delete()
-                elif se.docstatus == 1:
-                    se.cancel()
-                    se.delete()
-                frappe.db.commit()
-            except Exception as del_e:
-                if DEBUG: print(f"[DEBUG] Error during cleanup delete: {str(del_e)}")
-                frappe.log_error(frappe.get_traceback(), "Stock Entry Cleanup Error")
-            if DEBUG: print("[DEBUG] Deleted draft SE, falling back to reconciliation")
-            frappe.log_error(frappe.get_traceback(), "Stock Entry NegativeStockError")  # ADDED: Log specific error
-        except Exception as e:
-            if DEBUG: print(f"[DEBUG] Unexpected error during SE submit: {str(e)}")
-            # Safely delete
-            try:
-                se.reload()  # Reload to get current status
-                if se.docstatus == 0:
-                    se.delete()
-                elif se.docstatus == 1:
-                    se.cancel()
-                    se.delete()
-                frappe.db.commit()
-            except Exception as del_e:
-                if DEBUG: print(f"[DEBUG] Error during cleanup delete: {str(del_e)}")
-                frappe.log_error(frappe.get_traceback(), "Stock Entry Cleanup Error")
-            frappe.log_error(frappe.get_traceback(), "Stock Entry Submit Error")  # ADDED: Log with traceback
-            raise
-
-    # Second pass: collect reconciliations where qty doesn't match
-    reconcile_items = []
-    for asin, target_qty in asin_inbound.items():
-        item_code = frappe.db.get_value("Item", {"custom_asin": asin, "disabled": 0}, "name")
-        if not item_code:
-            continue
-
-        # ADDED: Skip if not a stock item
-        if not frappe.get_value("Item", item_code, "is_stock_item"):
-            if DEBUG: print(f"[DEBUG] Skipping non-stock item: {item_code}")
-            continue
-
-        current_inbound = frappe.db.get_value("Bin", {"item_code": item_code, "warehouse": inbound_wh}, "actual_qty") or 0
-        if current_inbound == target_qty:
-            if DEBUG: print(f"[DEBUG] Inbound qty matches for {item_code}: {current_inbound} == {target_qty}")
-            continue
-
-        if DEBUG: print(f"[DEBUG] Inbound qty mismatch for {item_code}: {current_inbound} != {target_qty}")
-        item_valuation_rate = frappe.get_value("Item", item_code, "valuation_rate") or 0
-        item_dict = {
-            "item_code": item_code,
-            "warehouse": inbound_wh,
-            "qty": target_qty,
-        }
-        if item_valuation_rate > 0:
-            item_dict["valuation_rate"] = item_valuation_rate
-        else:
-            item_dict["valuation_rate"] = 0.01
-        reconcile_items.append(item_dict)
-
-    # Fetch Amazon items in inbound warehouse with positive qty not reported by Amazon, assume 0
-    inbound_amazon_items = frappe.db.sql("""
-        SELECT i.name as item_code, i.custom_asin as asin, b.actual_qty, b.valuation_rate
-        FROM `tabItem` i
-        INNER JOIN `tabBin` b ON i.name = b.item_code
-        WHERE b.warehouse = %s AND i.custom_asin IS NOT NULL AND b.actual_qty > 0 AND i.disabled = 0 AND i.is_stock_item = 1
-    """, inbound_wh, as_dict=True)
-
-    # Candidates to zero: stocked Amazon items in this warehouse NOT reported by the API
-    inbound_zero_candidates = [r for r in inbound_amazon_items if r.asin not in asin_inbound]
-    inbound_total_stocked = len(inbound_amazon_items)  # Amazon items currently holding stock here
-    # Guard: refuse to zero if the unreported share exceeds the threshold (likely a partial pull)
-    if inbound_total_stocked and (len(inbound_zero_candidates) / inbound_total_stocked) > MAX_ZERO_OUT_FRACTION:
-        frappe.log_error(
-            f"Skipping inbound zero-out for {inbound_wh}: "
-            f"{len(inbound_zero_candidates)}/{inbound_total_stocked} stocked Amazon items "
-            f"unreported (> {MAX_ZERO_OUT_FRACTION:.0%}); treating as partial API pull.",
-            "FBA Inventory Zero-Out Guard",
-        )
-    else:
-        for row in inbound_zero_candidates:  # already excludes reported ASINs
-            item_valuation_rate = frappe.get_value("Item", row.item_code, "valuation_rate") or 0
-            item_dict = {
-                "item_code": row.item_code,
-                "warehouse": inbound_wh,
-                "qty": 0,
-            }
-            if item_valuation_rate > 0:
-                item_dict["valuation_rate"] = item_valuation_rate
-            else:
-                item_dict["valuation_rate"] = 0.01
-            reconcile_items.append(item_dict)
-
-    # Create and submit Stock Reconciliation if needed
-    if reconcile_items:
-        if DEBUG: print(f"[DEBUG] Creating Stock Reconciliation with {len(reconcile_items)} items...")
-        try:  # ADDED: Wrap for error logging
-            sr = frappe.get_doc({
-                "doctype": "Stock Reconciliation",
-                "company": company,
-                "posting_date": frappe.utils.today(),
-                "purpose": "Stock Reconciliation",
-                "expense_account": adjustment_account,
-                "items": reconcile_items,
-            })
-            sr.insert(ignore_permissions=True)
-            if DEBUG: print(f"[DEBUG] Inserted SR: {sr.name}")
-            if DEBUG:
-                if DEBUG: print(f"[DEBUG] DEBUG mode: leaving inbound SR {sr.name} as DRAFT (not submitted)")
-                frappe.db.commit()  # persist draft
-            else:
-                sr.submit()
-                frappe.db.commit()
-                if DEBUG: print(f"[DEBUG] Submitted inbound SR: {sr.name}")
-        except Exception:
-            frappe.log_error(frappe.get_traceback(), "Inbound Stock Reconciliation Error")
-            raise
-
-# ──────────────────────────────────────────
-# Orchestrator
-# ──────────────────────────────────────────
-def process_fba_inventory():
-    try:  # ADDED: High-level wrap for entire function
-        repo = AmazonRepository("q3opu7c5ac")
-        settings = repo.amz_setting
-        if DEBUG: print("[DEBUG] Starting FBA inventory sync...")
-
-        # Pull and parse marketplace IDs from settings
-        marketplace_ids = parse_marketplaces(settings.custom_marketplace)
-        if DEBUG: print(f"[DEBUG] Fetching for marketplaces: {marketplace_ids}")
-
-        # Aggregate across all marketplaces
-        summaries = []
-        
-
-        for mkt_id in marketplace_ids:
-            if DEBUG: print(f"[DEBUG] Querying marketplace: {mkt_id}")
-            base_qs = {
-                "granularityType": "Marketplace",
-                "granularityId": mkt_id,
-                "marketplaceIds": mkt_id,
-                "details": "true",  # no startDateTime: return full current snapshot, not a delta, so omitted SKUs aren't wrongly zeroed
-            }
-            if DEBUG: print(f"[DEBUG] Query parameters: {base_qs}")
-            next_token = None
-            page = 1
-            while True:
-                if next_token:
-                    qs = dict(base_qs)
-                    qs["nextToken"] = next_token
-                    if DEBUG: print(f"[DEBUG] Updated qs with nextToken: {qs}")
-                else:
-                    qs = dict(base_qs)  # First page uses the full snapshot filters
-
-                if DEBUG: print(f"[DEBUG] Fetching page {page} for {mkt_id}...")
-                try:  # ADDED: Wrap API call for logging
-                    resp = _sp_get("/fba/inventory/v1/summaries", qs, settings, return_full=True)  # Added return_full=True
-                except Exception:
-                    frappe.log_error(frappe.get_traceback(), f"API Call Error for Marketplace {mkt_id}")
-                    raise
-                #print(json.dumps(resp.get("payload", {}), indent=2))  # Uncomment if needed for verification
-                
-                # Print info for a specific asin
-                #for summary in resp.get("payload", {}).get("inventorySummaries", []):
-                #    if summary.get("asin") == "B09D8KWTBW":
-                #        print(json.dumps(summary, indent=2))
-                
-                page_summaries = resp.get("payload", {}).get("inventorySummaries", [])  # Extract from payload
-                summaries.extend(page_summaries)
-                if DEBUG: print(f"[DEBUG] Fetched {len(page_summaries)} summaries from page {page} for {mkt_id}")
-                if len(page_summaries) == 0:
-                    if DEBUG: print("[DEBUG] No summaries in this page - check if response has errors or warnings")
-                next_token = resp.get("pagination", {}).get("nextToken")  # Extract from top-level pagination
-                if not next_token:
-                    if DEBUG: print(f"[DEBUG] No more pages for {mkt_id}")
-                    break
-                time.sleep(1)  # Throttle between pages
-                page += 1
-            time.sleep(2)  # Throttle between marketplaces to avoid rate limits
-
-        if DEBUG: print(f"[DEBUG] Total summaries fetched: {len(summaries)}")
-        if summaries:
-            if DEBUG: print(f"[DEBUG] Sample summary: {summaries[0]}")  # Print first one for inspection
-        else:
-            if DEBUG: print("[DEBUG] No summaries fetched across all marketplaces - possible reasons: no FBA inventory in these marketplaces, missing 'Inventory' role in SP-API permissions, or try adding 'startDateTime' parameter for recent changes")
-
-        # Collect all unique conditions for debugging
-        conditions = set(s.get("condition", "UNKNOWN") for s in summaries)
-        if DEBUG: print(f"[DEBUG] Unique conditions found in summaries: {conditions}")
-
-        # Aggregate fulfillable and inbound qty by ASIN for new condition
-        asin_fulfillable = defaultdict(int)
-        asin_inbound = defaultdict(int)
-        for s in summaries:
-            cond = s.get("condition", "")  # Correct key per API docs
-            asin = s.get("asin", "")
-            details = s.get("inventoryDetails") or {}  # inventoryDetails sub-object, default empty dict
-            total_quantity = s.get("totalQuantity") or 0  # top-level total units in FC
-            researching_quantity = (
-                details.get("researchingQuantity") or {}
-            ).get("totalResearchingQuantity") or 0  # units under investigation, not sellable
-            fc_transfer_quantity = (
-                details.get("reservedQuantity") or {}
-            ).get("pendingTransshipmentQuantity") or 0  # units reserved for FC-to-FC transfer
-            fulfillable_qty = (
-                total_quantity - researching_quantity + fc_transfer_quantity
-            )  # derived sellable qty; do NOT use API fulfillableQuantity
-            #inbound_working = s.get("inventoryDetails", {}).get("inboundWorkingQuantity", 0) #Not included in calculations because this represents products that have been scheduled but not left our facility
-            inbound_shipped = s.get("inventoryDetails", {}).get("inboundShippedQuantity", 0)
-            inbound_receiving = s.get("inventoryDetails", {}).get("inboundReceivingQuantity", 0)
-            #inbound_qty = inbound_working + inbound_shipped + inbound_receiving
-            inbound_qty = inbound_shipped + inbound_receiving  # inboundWorkingQuantity excluded: these units have not left our facility yet
-            if DEBUG: print(f"[DEBUG] Processing summary: ASIN={asin}, Condition={cond}, FulfillableQty={fulfillable_qty}, InboundQty={inbound_qty}")
-            if cond != "NewItem":  # Filter to new condition (adjust if your data uses variants like "SELLABLE")
-                if DEBUG: print(f"[DEBUG] Skipping non-new condition: {cond}")
-                continue
-            # CRITICAL FIX: Use max() instead of += 
-            # The SP-API /fba/inventory/v1/summaries endpoint (when queried per marketplace)
-            # frequently returns the *exact same* FBA inventory data for an ASIN across
-            # every configured marketplace (common with unified NA/EU/PAN-EU accounts
-            # and shared fulfillment centers). Summing these duplicates inflates
-            # ERPNext target quantities. Taking the max ensures each physical ASIN
-            # is counted exactly once.
-            asin_fulfillable[asin] = max(asin_fulfillable[asin], fulfillable_qty)
-            asin_inbound[asin] = max(asin_inbound[asin], inbound_qty)
-            if DEBUG: print(f"[DEBUG] Added to asin_fulfillable: {asin} -> {asin_fulfillable[asin]}")
-            if DEBUG: print(f"[DEBUG] Added to asin_inbound: {asin} -> {asin_inbound[asin]}")
-
-        if DEBUG: print(f"[DEBUG] Aggregated asin_fulfillable: {dict(asin_fulfillable)}")
-        if DEBUG: print(f"[DEBUG] Aggregated asin_inbound: {dict(asin_inbound)}")
-
-        # Prepare Stock Reconciliation items for fulfillable
-        wh = settings.afn_warehouse
-        company = settings.company
-        adjustment_account = settings.custom_amazon_inventory_adjustment_account  # Assume this custom field exists in settings; add if needed
-        items_list = []
-        for asin, new_qty in asin_fulfillable.items():
-            item_code = frappe.db.get_value("Item", {"custom_asin": asin, "disabled": 0}, "name")
-            if not item_code:
-                if DEBUG: print(f"[DEBUG] No matching item_code found for ASIN: {asin}")
-                continue
-
-            # ADDED: Skip if not a stock item
-            if not frappe.get_value("Item", item_code, "is_stock_item"):
-                if DEBUG: print(f"[DEBUG] Skipping non-stock item: {item_code}")
-                continue
-
-            # Get current bin data
-            bin_data = frappe.db.get_value(
-                "Bin",
-                {"item_code": item_code, "warehouse": wh},
-                ["actual_qty", "valuation_rate"],
-                as_dict=True
-            ) or {}
-            current_qty = bin_data.get("actual_qty", 0)
-            if DEBUG: print(f"[DEBUG] Current qty in Bin: {current_qty} vs New qty: {new_qty} - {item_code}")
-            if int(current_qty) == new_qty:
-                continue  # No adjustment needed
-
-            item_valuation_rate = frappe.get_value("Item", item_code, "valuation_rate") or 0
-            item_dict = {
-                "item_code": item_code,
-                "warehouse": wh,
-                "qty": new_qty,
-            }
-            if item_valuation_rate > 0:
-                item_dict["valuation_rate"] = item_valuation_rate
-            else:
-                item_dict["valuation_rate"] = 0.01
-            items_list.append(item_dict)
-
-        # Fetch Amazon items in warehouse with positive qty not reported by Amazon, assume 0
-        amazon_items_in_wh = frappe.db.sql("""
-            SELECT i.name as item_code, i.custom_asin as asin, b.actual_qty, b.valuation_rate
-            FROM `tabItem` i
-            INNER JOIN `tabBin` b ON i.name = b.item_code
-            WHERE b.warehouse = %s AND i.custom_asin IS NOT NULL AND b.actual_qty > 0 AND i.disabled = 0 AND i.is_stock_item = 1
-        """, wh, as_dict=True)
-
-        # Candidates to zero: stocked Amazon items in this warehouse NOT reported by the API
-        zero_candidates = [r for r in amazon_items_in_wh if r.asin not in asin_fulfillable]
-        total_stocked = len(amazon_items_in_wh)  # Amazon items currently holding stock here
-        # Guard: refuse to zero if the unreported share exceeds the threshold (likely a partial pull)
-        if total_stocked and (len(zero_candidates) / total_stocked) > MAX_ZERO_OUT_FRACTION:
-            frappe.log_error(
-                f"Skipping fulfillable zero-out for {wh}: "
-                f"{len(zero_candidates)}/{total_stocked} stocked Amazon items "
-                f"unreported (> {MAX_ZERO_OUT_FRACTION:.0%}); treating as partial API pull.",
-                "FBA Inventory Zero-Out Guard",
-            )
-        else:
-            for row in zero_candidates:  # already excludes reported ASINs
-                item_valuation_rate = frappe.get_value("Item", row.item_code, "valuation_rate") or 0
-                item_dict = {
-                    "item_code": row.item_code,
-                    "warehouse": wh,
-                    "qty": 0,
-                }
-                if item_valuation_rate > 0:
-                    item_dict["valuation_rate"] = item_valuation_rate
-                else:
-                    item_dict["valuation_rate"] = 0.01
-                items_list.append(item_dict)
-
-        if DEBUG: print(f"[DEBUG] Total items to reconcile: {len(items_list)}")
-        if not items_list:
-            if DEBUG: print("[DEBUG] No items to sync - exiting early")
-        else:
-            # Create and submit Stock Reconciliation
-            if DEBUG: print("[DEBUG] Creating Stock Reconciliation...")
-            try:  # ADDED: Wrap for error logging
-                sr = frappe.get_doc({
-                    "doctype": "Stock Reconciliation",
-                    "company": company,
-                    "posting_date": frappe.utils.today(),
-                    "purpose": "Stock Reconciliation",
-                    "expense_account": adjustment_account,  # For value adjustments
-                    "items": items_list,
-                })
-                sr.insert(ignore_permissions=True)
-                if DEBUG: print(f"[DEBUG] Inserted SR: {sr.name}")
-                if DEBUG:
-                    if DEBUG: print(f"[DEBUG] DEBUG mode: leaving FBA fulfillable SR {sr.name} as DRAFT (not submitted)")
-                    frappe.db.commit()  # persist draft
-                else:
-                    sr.submit()
-                    frappe.db.commit()
-                    if DEBUG: print(f"[FBA_INV] Synced inventory via Stock Reconciliation {sr.name}")
-            except Exception:
-                frappe.log_error(frappe.get_traceback(), "Fulfillable Stock Reconciliation Error")
-                raise
-
-        # Process inbound inventory
-        process_inbound_inventory(asin_inbound, settings)
-    except Exception:
-        frappe.log_error(frappe.get_traceback(), "FBA Inventory Process Error")
-        raise
-
-# ──────────────────────────────────────────
-# Scheduler wrapper
-# ──────────────────────────────────────────
-"""
-frappe.call("eseller_suite.eseller_suite.doctype.amazon_sp_api_settings.amazon_sync_fba_inventory.run_daily_fba_inventory_sync")
-
-NOTE:
-You need to Manually Create Opening Stock Entries Before Running the Initial Sync
-Go to Stock > Stock Transactions > Stock Entry > New
-Set Stock Entry Type to "Material Receipt"
-Set Target Warehouse to your relevant warehouses (Amazon FBA, Amazon FBA Inbound, Amazon FBA Prep Area
-"""
-@frappe.whitelist()
-def run_daily_fba_inventory_sync():
-    """Hourly scheduler entry: sync FBA inventory (only runs at 8 AM)."""
-    
-    pst_tz = ZoneInfo("America/Los_Angeles")
-    now = datetime.now(pst_tz)
-    if now.hour != 7 and DEBUG == False:
-        return  # Only run at 7 AM in PST
-    
-    try:  # ADDED: Wrap scheduler call
-        frappe.get_doc("Amazon SP API Settings", "q3opu7c5ac")  # Load to ensure active
-        process_fba_inventory()
-    except Exception:
-        frappe.log_error(frappe.get_traceback(), "Daily FBA Inventory Sync Error")
+# amazon_sync_fba_inventory.py
+# =========================================
+#  Syncs Amazon FBA inventory quantities to ERPNext once per day
+#  using the FBA Inventory API (direct GET, no reports/POST needed).
+# =========================================
+from __future__ import annotations
+import json, requests
+import logging
+import os
+import re
+
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait
+from datetime import datetime
+from zoneinfo import ZoneInfo
+import frappe
+from frappe.utils import flt
+from .amazon_repository import _sp_get, _get_lwa_token, parse_rate_limit, RequestPacer
+
+from urllib.parse import urlencode
+
+from collections import defaultdict
+
+from erpnext.stock.stock_ledger import NegativeStockError
+from erpnext.stock.serial_batch_bundle import SerialBatchCreation
+
+# When True all docs are left as drafts and not submitted, debug logging is turned
+# on and the scheduler entry runs at any hour. To run on demand, call
+# process_fba_inventory() from bench console
+DEBUG = False
+
+# Debug output goes through this logger (logs/fba_inventory.log); %-style args are
+# only formatted when DEBUG level is enabled, so the calls are cheap in hot loops.
+log = frappe.logger("fba_inventory", allow_site=False, file_count=5)
+log.setLevel(logging.DEBUG if DEBUG else logging.INFO)
+
+# Belt-and-suspenders guard: if a single sync run would zero out more than this
+# fraction of the Amazon-linked items currently holding stock in a warehouse,
+# treat the API pull as partial/unhealthy and SKIP the zero-out for that warehouse
+# (reported adjustments still apply). Prevents a truncated response from wiping stock.
+MAX_ZERO_OUT_FRACTION = 0.10  # tune to your catalog's normal daily sell-through-to-zero rate
+
+# Upper bound on concurrent marketplace fetches. The summaries rate limit is per
+# selling account, not per marketplace, so extra threads would only queue on the pacer.
+MAX_FETCH_WORKERS = 4
+
+# Rows per Stock Reconciliation. ERPNext queues the submit of an SR with more
+# than 100 rows as a background job; staying at 100 keeps every submit inline
+# so the run still commits (or rolls back) as one transaction.
+SR_CHUNK_SIZE = 100
+
+# The sync runs from hourly_long (long queue and timeout) and only does work in this
+# hour. The gate uses an explicit time zone, so it does not depend on System Settings.
+# DEBUG, or FBA_SYNC_ANY_HOUR=1 in the worker/console environment, bypasses the gate.
+SYNC_TZ = ZoneInfo("America/Los_Angeles")
+SYNC_HOUR = 7
+SYNC_ANY_HOUR_ENV = "FBA_SYNC_ANY_HOUR"
+
+# ──────────────────────────────────────────
+# Helper Functions
+# ──────────────────────────────────────────
+_MKT_SPLIT = re.compile(r"[,\s]+")  # commas and/or whitespace between marketplace ids
+
+def parse_marketplaces(mkt_str: str) -> list[str]:
+    return [m for m in _MKT_SPLIT.split((mkt_str or "").strip()) if m]
+
+ASIN_CACHE_KEY = "asin_to_item"
+ASIN_CACHE_TTL = 7 * 24 * 60 * 60  # seconds; well above the daily sync period, Item saves invalidate via clear_asin_cache
+ITEM_FETCH_CHUNK = 1000  # ASINs per Item query; keeps the IN (...) list well under max_allowed_packet
+
+def asin_cache_key(asin) -> str:
+    """Site-scoped redis key for one ASIN."""
+    return frappe.cache().make_key(f"{ASIN_CACHE_KEY}:{asin}")
+
+def get_items_by_asin(asins) -> dict:
+    """
+    Resolve every ASIN to its enabled Item. Only the ASIN -> Item name mapping is
+    cached, one key per ASIN that expires after ASIN_CACHE_TTL (misses are cached
+    as ""), so only ASINs not seen since the last Item save or expiry are looked up.
+    Cached names are read with one MGET and new ones written with one pipeline.
+    The stock fields are always read fresh, ITEM_FETCH_CHUNK items at a time.
+    Returns {asin: row} where row carries name, is_stock_item, valuation_rate,
+    has_batch_no and has_serial_no.
+    """
+    if not asins:
+        return {}
+    cache = frappe.cache()
+    asins = list(asins)
+    names = {
+        asin: cached.decode() if cached is not None else None
+        for asin, cached in zip(asins, cache.mget([asin_cache_key(asin) for asin in asins]))
+    }
+    missing = [asin for asin, name in names.items() if name is None]
+    pipe = cache.pipeline()
+    for start in range(0, len(missing), ITEM_FETCH_CHUNK):
+        chunk = missing[start:start + ITEM_FETCH_CHUNK]
+        fetched = dict.fromkeys(chunk, "")
+        for item in frappe.get_all(
+            "Item",
+            filters={"custom_asin": ("in", chunk), "disabled": 0},
+            fields=["name", "custom_asin"],
+            order_by="creation asc",
+        ):
+            if not fetched[item.custom_asin]:  # first match wins, like get_value
+                fetched[item.custom_asin] = item.name
+        for asin, name in fetched.items():
+            pipe.set(asin_cache_key(asin), name, ex=ASIN_CACHE_TTL)
+        names.update(fetched)
+    if missing:
+        pipe.execute()
+
+    item_names = list({name for name in names.values() if name})
+    items = {}
+    for start in range(0, len(item_names), ITEM_FETCH_CHUNK):
+        for item in frappe.get_all(
+            "Item",
+            filters={"name": ("in", item_names[start:start + ITEM_FETCH_CHUNK]), "disabled": 0},
+            fields=["name", "is_stock_item", "valuation_rate", "has_batch_no", "has_serial_no"],
+        ):
+            items[item.name] = item
+    return {asin: items[name] for asin, name in names.items() if name in items}
+
+def clear_asin_cache(doc, method=None):
+    """Item doc_event: drop cached mappings for the Item's current and previous ASIN."""
+    asins = {doc.get("custom_asin")}
+    before = doc.get_doc_before_save()
+    if before:
+        asins.add(before.get("custom_asin"))
+    asins.discard(None)
+    asins.discard("")
+    if asins:
+        frappe.cache().delete(*(asin_cache_key(asin) for asin in asins))
+
+def get_bin_map(item_codes, warehouses) -> dict:
+    """
+    Fetch Bin rows for every (item_code, warehouse) pair in one query.
+    Returns {(item_code, warehouse): row}; missing pairs should fall back to EMPTY_BIN.
+    """
+    if not item_codes or not warehouses:
+        return {}
+    bins = frappe.db.sql("""
+        SELECT item_code, warehouse, actual_qty, valuation_rate
+        FROM `tabBin`
+        WHERE warehouse IN %(warehouses)s AND item_code IN %(item_codes)s
+    """, {"warehouses": tuple(warehouses), "item_codes": tuple(item_codes)}, as_dict=True)
+    return {(b.item_code, b.warehouse): b for b in bins}
+
+EMPTY_BIN = frappe._dict(actual_qty=0, valuation_rate=0)
+
+def dedupe_rows(rows, key_fields) -> list[dict]:
+    """
+    Keep only the last row for each key built from `key_fields` (batch_no is part
+    of the key so per-batch rows survive). Duplicate rows make the stock doc
+    validate the same line twice or fail outright.
+    """
+    by_key = {}
+    for row in rows:
+        by_key[tuple(row.get(field) for field in key_fields)] = row
+    return list(by_key.values())
+
+def get_serials_by_item(item_codes, warehouse) -> dict:
+    """Map item_code -> [Serial No names currently in `warehouse`], oldest first, in one query."""
+    serials_by_item = defaultdict(list)
+    if not item_codes:
+        return serials_by_item
+    rows = frappe.db.sql("""
+        SELECT name, item_code
+        FROM `tabSerial No`
+        WHERE warehouse = %s AND item_code IN %s
+        ORDER BY item_code, creation
+    """, (warehouse, tuple(item_codes)), as_dict=True)
+    for row in rows:
+        serials_by_item[row.item_code].append(row.name)
+    return serials_by_item
+
+def get_stocked_amazon_items(warehouse) -> list:
+    """
+    Enabled stock Items with an ASIN that hold positive qty in `warehouse`, with the
+    Item valuation rate so zero-out rows need no further lookups.
+    Served by the (custom_asin, disabled, is_stock_item) index on Item and the
+    (item_code, warehouse) index on Bin.
+    """
+    item = frappe.qb.DocType("Item")
+    bin = frappe.qb.DocType("Bin")
+    return (
+        frappe.qb.from_(bin)
+        .inner_join(item)
+        .on(item.name == bin.item_code)
+        .select(
+            item.name.as_("item_code"),
+            item.custom_asin.as_("asin"),
+            bin.actual_qty,
+            bin.valuation_rate,
+            item.valuation_rate.as_("item_valuation_rate"),
+        )
+        .where(
+            (bin.warehouse == warehouse)
+            & (bin.actual_qty > 0)
+            & item.custom_asin.isnotnull()
+            & (item.custom_asin != "")
+            & (item.disabled == 0)
+            & (item.is_stock_item == 1)
+        )
+    ).run(as_dict=True)
+
+def get_batches_by_item(item_codes) -> dict:
+    """Map item_code -> [batch names, oldest first] for all batched items in one query."""
+    batches_by_item = defaultdict(list)
+    if not item_codes:
+        return batches_by_item
+    for batch in frappe.get_all(
+        "Batch",
+        filters={"item": ("in", list(item_codes))},
+        fields=["name", "item"],
+        order_by="creation asc",
+    ):
+        batches_by_item[batch.item].append(batch.name)
+    return batches_by_item
+
+def get_batch_qty_map(item_codes, warehouse) -> dict:
+    """
+    Per-batch stock of every given item in `warehouse`, as {(item_code, batch_no): qty};
+    batches with no stock left are omitted.
+    One grouped ledger query replaces a get_batch_qty() call per batch. Covers both
+    Serial and Batch Bundle entries and legacy SLEs that carry batch_no directly.
+    """
+    if not item_codes:
+        return {}
+    rows = frappe.db.sql("""
+        SELECT item_code, batch_no, SUM(qty) AS qty
+        FROM (
+            SELECT sle.item_code, sle.batch_no, sle.actual_qty AS qty
+            FROM `tabStock Ledger Entry` sle
+            WHERE sle.warehouse = %(warehouse)s AND sle.item_code IN %(item_codes)s
+                AND sle.is_cancelled = 0
+                AND IFNULL(sle.batch_no, '') != '' AND IFNULL(sle.serial_and_batch_bundle, '') = ''
+            UNION ALL
+            SELECT sle.item_code, sbe.batch_no, sbe.qty
+            FROM `tabStock Ledger Entry` sle
+            INNER JOIN `tabSerial and Batch Entry` sbe ON sbe.parent = sle.serial_and_batch_bundle
+            WHERE sle.warehouse = %(warehouse)s AND sle.item_code IN %(item_codes)s
+                AND sle.is_cancelled = 0
+                AND IFNULL(sbe.batch_no, '') != ''
+        ) batch_ledger
+        GROUP BY item_code, batch_no
+        HAVING qty > 0
+    """, {"warehouse": warehouse, "item_codes": tuple(item_codes)}, as_dict=True)
+    return {(r.item_code, r.batch_no): r.qty for r in rows}
+
+# ──────────────────────────────────────────
+# Inventory Summaries Fetching
+# ──────────────────────────────────────────
+class AccessToken:
+    """
+    LWA access token shared with the marketplace workers. Refreshing may read
+    client_secret from the DB, so only the thread that created it may refresh;
+    workers only read `value`, which the owner keeps current between their pages.
+    """
+    REFRESH_EVERY = 10  # seconds between owner-side expiry checks while workers run
+    def __init__(self, settings):
+        self.settings = settings
+        self._owner = threading.get_ident()
+        self.value = None
+        self.refresh()
+
+    def refresh(self):
+        if threading.get_ident() != self._owner:
+            raise RuntimeError("AccessToken can only be refreshed by the thread that created it")
+        self.value = _get_lwa_token(self.settings)  # only hits LWA (and the DB) near expiry
+
+def run_in_site(site, sites_path, fn, *args):
+    """
+    Run `fn` on a worker thread with frappe.local initialised for `site`, so
+    loggers keep the site. No DB connection is opened: workers must not use it.
+    """
+    frappe.init(site=site, sites_path=sites_path)
+    try:
+        return fn(*args)
+    finally:
+        frappe.destroy()
+
+def fetch_marketplace(mkt_id, settings, token: AccessToken, pacer: RequestPacer) -> tuple[dict, dict, int]:
+    """
+    Page through /fba/inventory/v1/summaries for one marketplace, folding each
+    page into ASIN totals as it arrives so only one page is held at a time.
+    Every page uses the current `token.value`; runs on a worker thread.
+    Returns (asin_fulfillable, asin_inbound, number of summaries fetched).
+    """
+    log.debug("Querying marketplace: %s", mkt_id)
+    base_qs = {
+        "granularityType": "Marketplace",
+        "granularityId": mkt_id,
+        "marketplaceIds": mkt_id,
+        "details": "true",  # no startDateTime: return full current snapshot, not a delta, so omitted SKUs aren't wrongly zeroed
+    }
+    log.debug("Query parameters: %s", base_qs)
+    asin_fulfillable = {}
+    asin_inbound = {}
+    fetched = 0
+    qs = dict(base_qs)  # _sp_get urlencodes per call, so one dict is reused across pages
+    page = 1
+    while True:
+        log.debug("Fetching page %s for %s...", page, mkt_id)
+        pacer.wait()
+        resp = _sp_get("/fba/inventory/v1/summaries", qs, settings, return_full=True, access_token=token.value)  # Added return_full=True
+        pacer.update(parse_rate_limit(resp.get("__headers__") or {}))
+        #print(json.dumps(resp.get("payload", {}), indent=2))  # Uncomment if needed for verification
+
+        # Print info for a specific asin
+        #for summary in resp.get("payload", {}).get("inventorySummaries", []):
+        #    if summary.get("asin") == "B09D8KWTBW":
+        #        print(json.dumps(summary, indent=2))
+
+        page_summaries = resp.get("payload", {}).get("inventorySummaries", [])  # Extract from payload
+        aggregate_summaries(page_summaries, asin_fulfillable, asin_inbound)
+        fetched += len(page_summaries)
+        log.debug("Fetched %s summaries from page %s for %s", len(page_summaries), page, mkt_id)
+        if len(page_summaries) == 0:
+            log.debug("No summaries in this page - check if response has errors or warnings")
+        elif log.isEnabledFor(logging.DEBUG):  # the condition set is built eagerly, so guard it
+            if page == 1: log.debug("Sample summary: %s", page_summaries[0])  # Print first one for inspection
+            log.debug("Conditions in page %s: %s", page, {s.get("condition", "UNKNOWN") for s in page_summaries})
+        next_token = resp.get("pagination", {}).get("nextToken")  # Extract from top-level pagination
+        if not next_token:
+            log.debug("No more pages for %s", mkt_id)
+            break
+        qs["nextToken"] = next_token
+        log.debug("Updated qs with nextToken: %s", qs)
+        page += 1
+    return asin_fulfillable, asin_inbound, fetched
+
+def aggregate_summaries(summaries, asin_fulfillable, asin_inbound):
+    """
+    Fold inventory summaries into per-ASIN fulfillable and inbound qty (new condition only).
+    Hot loop: filter first, dereference inventoryDetails once, no per-row debug output.
+    """
+    fulfillable_get = asin_fulfillable.get
+    inbound_get = asin_inbound.get
+    for s in summaries:
+        if s.get("condition") != "NewItem":  # Filter to new condition (adjust if your data uses variants like "SELLABLE")
+            continue
+        asin = s.get("asin", "")
+        details = s.get("inventoryDetails") or {}  # inventoryDetails sub-object, default empty dict
+        researching_quantity = (
+            details.get("researchingQuantity") or {}
+        ).get("totalResearchingQuantity") or 0  # units under investigation, not sellable
+        fc_transfer_quantity = (
+            details.get("reservedQuantity") or {}
+        ).get("pendingTransshipmentQuantity") or 0  # units reserved for FC-to-FC transfer
+        # derived sellable qty from top-level totalQuantity; do NOT use API fulfillableQuantity
+        fulfillable_qty = (s.get("totalQuantity") or 0) - researching_quantity + fc_transfer_quantity
+        # inboundWorkingQuantity excluded: these units have not left our facility yet
+        inbound_qty = details.get("inboundShippedQuantity", 0) + details.get("inboundReceivingQuantity", 0)
+        # CRITICAL FIX: Use max() instead of += 
+        # The SP-API /fba/inventory/v1/summaries endpoint (when queried per marketplace)
+        # frequently returns the *exact same* FBA inventory data for an ASIN across
+        # every configured marketplace (common with unified NA/EU/PAN-EU accounts
+        # and shared fulfillment centers). Summing these duplicates inflates
+        # ERPNext target quantities. Taking the max ensures each physical ASIN
+        # is counted exactly once.
+        asin_fulfillable[asin] = max(fulfillable_get(asin, 0), fulfillable_qty)
+        asin_inbound[asin] = max(inbound_get(asin, 0), inbound_qty)
+
+def merge_max(target, source):
+    """Merge per-ASIN quantities into `target`, keeping the larger value (see aggregate_summaries)."""
+    for asin, qty in source.items():
+        target[asin] = max(target.get(asin, 0), qty)
+
+# ──────────────────────────────────────────
+# Stock Reconciliation
+# ──────────────────────────────────────────
+def make_stock_reconciliation(items, company, adjustment_account, label, posting_date=None) -> list:
+    """
+    Insert Stock Reconciliations for `items`, SR_CHUNK_SIZE rows each, and submit
+    them (left as drafts in DEBUG mode). Returns the created docs.
+    Does not commit; process_fba_inventory commits the whole run once.
+    Each parent is inserted unvalidated and its rows are written with one bulk insert;
+    the doc is then validated once, by submit() or, for DEBUG drafts, by save(), which
+    fills the computed row fields (current qty/rate, amounts, differences).
+    Errors are logged as "<label> Stock Reconciliation Error" and re-raised.
+    """
+    items = dedupe_rows(items, ("item_code", "warehouse", "batch_no"))
+    log.debug("Creating %s Stock Reconciliation with %s items...", label, len(items))
+    try:  # ADDED: Wrap for error logging
+        srs = []
+        for start in range(0, len(items), SR_CHUNK_SIZE):
+            sr = frappe.new_doc("Stock Reconciliation")
+            sr.update({
+                "company": company,
+                "posting_date": posting_date or frappe.utils.today(),
+                "purpose": "Stock Reconciliation",
+                "expense_account": adjustment_account,  # For value adjustments
+            })
+            sr.flags.ignore_validate = True   # validated on submit, once the rows exist
+            sr.flags.ignore_mandatory = True  # items are bulk inserted below
+            sr.insert(ignore_permissions=True)
+            sr.flags.ignore_validate = sr.flags.ignore_mandatory = False
+            insert_reconciliation_items(sr, items[start:start + SR_CHUNK_SIZE])
+            sr.reload()
+            if DEBUG:
+                sr.save(ignore_permissions=True)  # bulk inserted rows lack the computed fields
+                log.debug("DEBUG mode: leaving %s SR %s as DRAFT (not submitted)", label, sr.name)
+            else:
+                sr.submit()
+            srs.append(sr)
+        return srs
+    except Exception:
+        frappe.log_error(frappe.get_traceback(), f"{label} Stock Reconciliation Error")
+        raise
+
+def insert_reconciliation_items(sr, items):
+    """Write `items` as Stock Reconciliation Item rows of `sr` with a single multi-row INSERT."""
+    item_fields = sorted({field for item in items for field in item})
+    fields = ["name", "parent", "parenttype", "parentfield", "idx", "docstatus",
+              "owner", "modified_by", "creation", "modified"] + item_fields
+    values = [
+        (frappe.generate_hash(length=10), sr.name, sr.doctype, "items", idx, 0,
+         sr.owner, sr.owner, sr.creation, sr.creation) + tuple(item.get(field) for field in item_fields)
+        for idx, item in enumerate(items, start=1)
+    ]
+    frappe.db.bulk_insert("Stock Reconciliation Item", fields, values)
+
+# ──────────────────────────────────────────
+# Stock Entry
+# ──────────────────────────────────────────
+def make_outward_batch_bundle(item_code, warehouse, batches, company, posting_date) -> str:
+    """
+    Draft Outward Serial and Batch Bundle taking `batches` ({batch_no: qty}) out of
+    `warehouse`, for a Stock Entry row to link; the Stock Entry submits it and builds
+    the matching inward bundle for the target warehouse.
+    """
+    return SerialBatchCreation({
+        "item_code": item_code,
+        "warehouse": warehouse,
+        "company": company,
+        "voucher_type": "Stock Entry",
+        "posting_date": posting_date,
+        "posting_time": frappe.utils.nowtime(),
+        "type_of_transaction": "Outward",
+        "batches": frappe._dict(batches),
+        "do_not_submit": True,
+    }).make_serial_and_batch_bundle().name
+
+# ──────────────────────────────────────────
+# Inbound Processing
+# ──────────────────────────────────────────
+def process_inbound_inventory(asin_inbound, settings, item_by_asin=None, submit_reconciliation=True, posting_date=None):
+    """
+    Move prep-area stock to the inbound warehouse and reconcile the inbound
+    warehouse to Amazon's inbound quantities. Returns the inbound reconcile
+    rows; with submit_reconciliation=False they are returned without being submitted.
+    """
+    if item_by_asin is None:
+        item_by_asin = get_items_by_asin(asin_inbound)
+    prep_wh = settings.custom_amazon_fba_staging_area
+    inbound_wh = settings.custom_amazon_inbound_warehouse
+    company = settings.company
+    adjustment_account = settings.custom_amazon_inventory_adjustment_account
+    posting_date = posting_date or frappe.utils.today()
+
+    log.debug("Starting inbound inventory processing for warehouse: %s", inbound_wh)
+
+    # Bin rows for the prep and inbound warehouses, fetched in one query and
+    # refreshed in bulk after each submit that moves stock
+    inbound_item_codes = [item_by_asin[asin].name for asin in asin_inbound if asin in item_by_asin]
+    bin_map = get_bin_map(inbound_item_codes, (prep_wh, inbound_wh))
+
+    # Batches and their prep-area qty for all batched items, instead of per batch
+    batch_item_codes = [
+        item_by_asin[asin].name for asin in asin_inbound
+        if asin in item_by_asin and item_by_asin[asin].has_batch_no
+    ]
+    batches_by_item = get_batches_by_item(batch_item_codes)
+    batch_qty_map = get_batch_qty_map(batch_item_codes, prep_wh)
+
+    # Serial Nos in the prep area for all serialized items
+    serial_item_codes = [
+        item_by_asin[asin].name for asin in asin_inbound
+        if asin in item_by_asin and item_by_asin[asin].has_serial_no
+    ]
+    serials_by_item = get_serials_by_item(serial_item_codes, prep_wh)
+
+    # Single pass over the report: resolve each ASIN once, plan transfers for increases
+    # and remember (item, target_qty) so the post-transfer reconciliation can reuse it
+    transfer_items = []
+    transfer_batches = {}  # item_code -> {batch_no: qty} moved on that item's single transfer row
+    prep_reconcile_items = []
+    transfer_pending = []
+    inbound_plan = []
+    for asin, target_qty in asin_inbound.items():
+        log.debug("Processing inbound ASIN: %s with target_qty: %s", asin, target_qty)
+        item = item_by_asin.get(asin)
+        if not item:
+            log.debug("No matching item_code found for ASIN: %s", asin)
+            continue
+        item_code = item.name
+
+        # ADDED: Skip if not a stock item
+        if not item.is_stock_item:
+            log.debug("Skipping non-stock item: %s", item_code)
+            continue
+        inbound_plan.append((item, target_qty))
+
+        current_inbound = bin_map.get((item_code, inbound_wh), EMPTY_BIN).actual_qty or 0
+        diff = target_qty - current_inbound
+        log.debug("Current inbound qty: %s, diff: %s", current_inbound, diff)
+        if diff <= 0:
+            continue
+
+        bin_data_prep = bin_map.get((item_code, prep_wh), EMPTY_BIN)
+        current_prep = bin_data_prep.actual_qty or 0
+        transfer_qty = min(current_prep, diff)
+        log.debug("Current prep qty: %s, transfer_qty: %s", current_prep, transfer_qty)
+        if transfer_qty <= 0:
+            continue
+
+        bin_rate = bin_data_prep.valuation_rate or 0
+
+        item_valuation_rate = item.valuation_rate or 0
+        val_rate = item_valuation_rate if item_valuation_rate > 0 else 0.01
+
+        has_batch = item.has_batch_no
+        has_serial = item.has_serial_no
+
+        reconcile_needed = (bin_rate != val_rate)
+
+        if reconcile_needed:
+            item_reconcile_items = []
+            if has_serial:
+                serial_nos = serials_by_item[item_code]
+                if len(serial_nos) == current_prep:
+                    item_reconcile_items.append({
+                        "item_code": item_code,
+                        "warehouse": prep_wh,
+                        "qty": current_prep,
+                        "valuation_rate": val_rate,
+                        "serial_no": '\n'.join(serial_nos),
+                    })
+            elif has_batch:
+                for batch_no in batches_by_item[item_code]:
+                    batch_qty = batch_qty_map.get((item_code, batch_no)) or 0
+                    if batch_qty > 0:
+                        item_reconcile_items.append({
+                            "item_code": item_code,
+                            "warehouse": prep_wh,
+                            "qty": batch_qty,
+                            "valuation_rate": val_rate,
+                            "batch_no": batch_no,
+                        })
+            else:
+                item_reconcile_items.append({
+                    "item_code": item_code,
+                    "warehouse": prep_wh,
+                    "qty": current_prep,
+                    "valuation_rate": val_rate,
+                })
+            if item_reconcile_items:
+                prep_reconcile_items += item_reconcile_items
+                transfer_pending.append((item_code, transfer_qty, has_batch, has_serial, val_rate))
+            else:
+                log.debug("Could not create reconcile items for %s, skipping transfer", item_code)
+        else:
+            transfer_pending.append((item_code, transfer_qty, has_batch, has_serial, val_rate))
+
+    # Create and submit Prep Stock Reconciliation if needed. This one cannot be
+    # merged with the others: it must fix the prep-area rate before the transfer.
+    if prep_reconcile_items:
+        make_stock_reconciliation(prep_reconcile_items, company, adjustment_account, "Prep", posting_date)
+
+    # Now process pending transfers. The Prep SR re-posts the same serial nos at
+    # the new rate, so serials_by_item is still current and is not refetched.
+    if prep_reconcile_items:
+        bin_map = get_bin_map(inbound_item_codes, (prep_wh, inbound_wh))
+        batch_qty_map = get_batch_qty_map(batch_item_codes, prep_wh)
+    for item_code, transfer_qty, has_batch, has_serial, val_rate in transfer_pending:
+        current_prep = bin_map.get((item_code, prep_wh), EMPTY_BIN).actual_qty or 0
+        transfer_qty = min(current_prep, transfer_qty)
+        if transfer_qty <= 0:
+            continue
+        if has_serial:
+            serial_nos = serials_by_item[item_code][:int(transfer_qty)]
+            if len(serial_nos) == transfer_qty:
+                transfer_items.append({
+                    "item_code": item_code,
+                    "s_warehouse": prep_wh,
+                    "t_warehouse": inbound_wh,
+                    "qty": transfer_qty,
+                    "basic_rate": val_rate,
+                    "serial_no": '\n'.join(serial_nos),
+                })
+            else:
+                log.debug("Insufficient serial nos for %s, skipping transfer", item_code)
+        elif has_batch:
+            # One row per item; its batches ride on a single Serial and Batch Bundle
+            remaining = transfer_qty
+            batches = {}
+            for batch_no in batches_by_item[item_code]:
+                if remaining <= 0:
+                    break
+                batch_qty = batch_qty_map.get((item_code, batch_no)) or 0
+                if batch_qty > 0:
+                    move_qty = min(batch_qty, remaining)
+                    batches[batch_no] = move_qty
+                    remaining -= move_qty
+            if batches:
+                transfer_batches[item_code] = batches
+                transfer_items.append({
+                    "item_code": item_code,
+                    "s_warehouse": prep_wh,
+                    "t_warehouse": inbound_wh,
+                    "qty": transfer_qty - remaining,
+                    "basic_rate": val_rate,
+                })
+            if remaining > 0:
+                log.debug("Insufficient batch qty for %s, transferred %s, remaining %s will be handled by reconciliation", item_code, transfer_qty - remaining, remaining)
+        else:
+            transfer_items.append({
+                "item_code": item_code,
+                "s_warehouse": prep_wh,
+                "t_warehouse": inbound_wh,
+                "qty": transfer_qty,
+                "basic_rate": val_rate,
+            })
+
+    # Create and submit Stock Entry if needed
+    if transfer_items:
+        transfer_items = dedupe_rows(transfer_items, ("item_code", "s_warehouse", "t_warehouse", "batch_no"))
+        log.debug("Creating Stock Entry with %s items...", len(transfer_items))
+        # Savepoint so a failed transfer can be undone without losing the
+        # Prep reconciliation written earlier in the same transaction
+        frappe.db.savepoint("fba_inbound_se")
+        try:
+            for row in transfer_items:
+                if row["item_code"] in transfer_batches:
+                    row["serial_and_batch_bundle"] = make_outward_batch_bundle(
+                        row["item_code"], prep_wh, transfer_batches[row["item_code"]], company, posting_date
+                    )
+            se = frappe.get_doc({
+                "doctype": "Stock Entry",
+                "company": company,
+                "stock_entry_type": "Material Transfer",
+                "from_warehouse": prep_wh,
+                "to_warehouse": inbound_wh,
+                "posting_date": posting_date,
+                "items": transfer_items,
+            })
+            se.insert(ignore_permissions=True)
+            if DEBUG:
+                log.debug("DEBUG mode: leaving SE %s as DRAFT (not submitted)", se.name)
+            else:
+                se.submit()
+        except NegativeStockError as e:
+            log.debug("NegativeStockError during submit: %s", e)
+            frappe.db.rollback(save_point="fba_inbound_se")
+            log.debug("Rolled back SE, falling back to reconciliation")
+            frappe.log_error(frappe.get_traceback(), "Stock Entry NegativeStockError")  # ADDED: Log specific error
+        except Exception as e:
+            log.debug("Unexpected error during SE submit: %s", e)
+            frappe.db.rollback(save_point="fba_inbound_se")
+            frappe.log_error(frappe.get_traceback(), "Stock Entry Submit Error")  # ADDED: Log with traceback
+            raise
+
+    # Reconcile against the post-transfer inbound qty; the plan already holds
+    # only resolved stock items, so there is nothing to look up again. Only the
+    # transferred items' inbound Bins can have moved, so only those are refetched.
+    if transfer_items:
+        transferred_item_codes = {row["item_code"] for row in transfer_items}
+        bin_map.update(get_bin_map(transferred_item_codes, (inbound_wh,)))
+    # Steady state, most inbound Bins already match; drop those before any row work
+    stale_plan = [
+        (item, target_qty) for item, target_qty in inbound_plan
+        if flt(bin_map.get((item.name, inbound_wh), EMPTY_BIN).actual_qty) != flt(target_qty)
+    ]
+    log.debug("%s of %s inbound items need reconciling", len(stale_plan), len(inbound_plan))
+    reconcile_items = []
+    for item, target_qty in stale_plan:
+        item_code = item.name
+        item_valuation_rate = item.valuation_rate or 0
+        item_dict = {
+            "item_code": item_code,
+            "warehouse": inbound_wh,
+            "qty": target_qty,
+        }
+        if item_valuation_rate > 0:
+            item_dict["valuation_rate"] = item_valuation_rate
+        else:
+            item_dict["valuation_rate"] = 0.01
+        reconcile_items.append(item_dict)
+
+    # Fetch Amazon items in inbound warehouse with positive qty not reported by Amazon, assume 0
+    inbound_amazon_items = get_stocked_amazon_items(inbound_wh)
+
+    # Candidates to zero: stocked Amazon items in this warehouse NOT reported by the API
+    inbound_zero_candidates = [r for r in inbound_amazon_items if r.asin not in asin_inbound]
+    inbound_total_stocked = len(inbound_amazon_items)  # Amazon items currently holding stock here
+    # Guard: refuse to zero if the unreported share exceeds the threshold (likely a partial pull)
+    if not inbound_zero_candidates:
+        log.debug("Every stocked Amazon item in %s was reported - nothing to zero out", inbound_wh)
+    elif inbound_total_stocked and (len(inbound_zero_candidates) / inbound_total_stocked) > MAX_ZERO_OUT_FRACTION:
+        frappe.log_error(
+            f"Skipping inbound zero-out for {inbound_wh}: "
+            f"{len(inbound_zero_candidates)}/{inbound_total_stocked} stocked Amazon items "
+            f"unreported (> {MAX_ZERO_OUT_FRACTION:.0%}); treating as partial API pull.",
+            "FBA Inventory Zero-Out Guard",
+        )
+    else:
+        for row in inbound_zero_candidates:  # already excludes reported ASINs
+            item_valuation_rate = row.item_valuation_rate or 0
+            item_dict = {
+                "item_code": row.item_code,
+                "warehouse": inbound_wh,
+                "qty": 0,
+            }
+            if item_valuation_rate > 0:
+                item_dict["valuation_rate"] = item_valuation_rate
+            else:
+                item_dict["valuation_rate"] = 0.01
+            reconcile_items.append(item_dict)
+
+    # Create and submit Stock Reconciliation if needed, unless the caller
+    # folds these rows into its own reconciliation
+    if reconcile_items and submit_reconciliation:
+        make_stock_reconciliation(reconcile_items, company, adjustment_account, "Inbound", posting_date)
+    return reconcile_items
+
+# ──────────────────────────────────────────
+# Orchestrator
+# ──────────────────────────────────────────
+def process_fba_inventory(settings=None):
+    try:  # ADDED: High-level wrap for entire function
+        if settings is None:
+            settings = frappe.get_cached_doc("Amazon SP API Settings", "q3opu7c5ac")
+        log.debug("Starting FBA inventory sync...")
+
+        # Pull and parse marketplace IDs from settings
+        marketplace_ids = parse_marketplaces(settings.custom_marketplace)
+        log.debug("Fetching for marketplaces: %s", marketplace_ids)
+
+        # Aggregate across all marketplaces. Each marketplace pages on its own
+        # worker and folds its pages into ASIN totals as they arrive; the shared
+        # pacer keeps the combined request rate within limits.
+        asin_fulfillable = {}
+        asin_inbound = {}
+        total_fetched = 0
+        if marketplace_ids:
+            # Workers get no DB connection, so the token is fetched and refreshed on this thread
+            token = AccessToken(settings)
+            pacer = RequestPacer()
+            with ThreadPoolExecutor(max_workers=min(len(marketplace_ids), MAX_FETCH_WORKERS)) as executor:
+                futures = {
+                    mkt_id: executor.submit(
+                        run_in_site, frappe.local.site, frappe.local.sites_path,
+                        fetch_marketplace, mkt_id, settings, token, pacer,
+                    )
+                    for mkt_id in marketplace_ids
+                }
+                pending = set(futures.values())
+                while pending:
+                    _done, pending = wait(pending, timeout=AccessToken.REFRESH_EVERY)
+                    if pending:
+                        token.refresh()
+            for mkt_id, future in futures.items():
+                try:  # ADDED: Wrap API call for logging
+                    mkt_fulfillable, mkt_inbound, fetched = future.result()
+                except Exception:
+                    frappe.log_error(frappe.get_traceback(), f"API Call Error for Marketplace {mkt_id}")
+                    raise
+                merge_max(asin_fulfillable, mkt_fulfillable)
+                merge_max(asin_inbound, mkt_inbound)
+                total_fetched += fetched
+
+        log.debug("Total summaries fetched: %s", total_fetched)
+        if not total_fetched:
+            log.debug("No summaries fetched across all marketplaces - possible reasons: no FBA inventory in these marketplaces, missing 'Inventory' role in SP-API permissions, or try adding 'startDateTime' parameter for recent changes")
+
+        log.debug("Aggregated asin_fulfillable: %s", asin_fulfillable)
+        log.debug("Aggregated asin_inbound: %s", asin_inbound)
+
+        # Resolve every reported ASIN to its Item once; both passes read from this map
+        item_by_asin = get_items_by_asin(set(asin_fulfillable) | set(asin_inbound))
+
+        # Prepare Stock Reconciliation items for fulfillable
+        wh = settings.afn_warehouse
+        company = settings.company
+        adjustment_account = settings.custom_amazon_inventory_adjustment_account  # Assume this custom field exists in settings; add if needed
+        posting_date = frappe.utils.today()  # one date for every doc in the run, even across midnight
+        items_list = []
+        fulfillable_item_codes = [item_by_asin[asin].name for asin in asin_fulfillable if asin in item_by_asin]
+        bin_map = get_bin_map(fulfillable_item_codes, (wh,))
+        for asin, new_qty in asin_fulfillable.items():
+            item = item_by_asin.get(asin)
+            if not item:
+                log.debug("No matching item_code found for ASIN: %s", asin)
+                continue
+            item_code = item.name
+
+            # ADDED: Skip if not a stock item
+            if not item.is_stock_item:
+                log.debug("Skipping non-stock item: %s", item_code)
+                continue
+
+            # Get current bin data
+            bin_data = bin_map.get((item_code, wh), EMPTY_BIN)
+            current_qty = bin_data.actual_qty or 0
+            log.debug("Current qty in Bin: %s vs New qty: %s - %s", current_qty, new_qty, item_code)
+            if flt(current_qty) == flt(new_qty):
+                continue  # No adjustment needed
+
+            item_valuation_rate = item.valuation_rate or 0
+            item_dict = {
+                "item_code": item_code,
+                "warehouse": wh,
+                "qty": new_qty,
+            }
+            if item_valuation_rate > 0:
+                item_dict["valuation_rate"] = item_valuation_rate
+            else:
+                item_dict["valuation_rate"] = 0.01
+            items_list.append(item_dict)
+
+        # Fetch Amazon items in warehouse with positive qty not reported by Amazon, assume 0
+        amazon_items_in_wh = get_stocked_amazon_items(wh)
+
+        # Candidates to zero: stocked Amazon items in this warehouse NOT reported by the API
+        zero_candidates = [r for r in amazon_items_in_wh if r.asin not in asin_fulfillable]
+        total_stocked = len(amazon_items_in_wh)  # Amazon items currently holding stock here
+        # Guard: refuse to zero if the unreported share exceeds the threshold (likely a partial pull)
+        if not zero_candidates:
+            log.debug("Every stocked Amazon item in %s was reported - nothing to zero out", wh)
+        elif total_stocked and (len(zero_candidates) / total_stocked) > MAX_ZERO_OUT_FRACTION:
+            frappe.log_error(
+                f"Skipping fulfillable zero-out for {wh}: "
+                f"{len(zero_candidates)}/{total_stocked} stocked Amazon items "
+                f"unreported (> {MAX_ZERO_OUT_FRACTION:.0%}); treating as partial API pull.",
+                "FBA Inventory Zero-Out Guard",
+            )
+        else:
+            for row in zero_candidates:  # already excludes reported ASINs
+                item_valuation_rate = row.item_valuation_rate or 0
+                item_dict = {
+                    "item_code": row.item_code,
+                    "warehouse": wh,
+                    "qty": 0,
+                }
+                if item_valuation_rate > 0:
+                    item_dict["valuation_rate"] = item_valuation_rate
+                else:
+                    item_dict["valuation_rate"] = 0.01
+                items_list.append(item_dict)
+
+        # Process inbound inventory. Its reconcile rows share company, purpose,
+        # expense account and posting date with the fulfillable ones, so both go
+        # into a single Stock Reconciliation and pay the submit cost once.
+        items_list += process_inbound_inventory(asin_inbound, settings, item_by_asin, submit_reconciliation=False, posting_date=posting_date)
+
+        log.debug("Total items to reconcile: %s", len(items_list))
+        if not items_list:
+            log.debug("No items to sync - exiting early")
+        else:
+            srs = make_stock_reconciliation(items_list, company, adjustment_account, "FBA", posting_date)
+            log.info("Synced inventory via Stock Reconciliation %s", ", ".join(sr.name for sr in srs))
+        # One commit for the whole run: Prep SR, transfer and FBA SR land together
+        frappe.db.commit()
+    except Exception:
+        traceback = frappe.get_traceback()
+        frappe.db.rollback()  # drop the partial run, then persist the error log
+        frappe.log_error(traceback, "FBA Inventory Process Error")
+        frappe.db.commit()
+        raise
+
+# ──────────────────────────────────────────
+# Scheduler wrapper
+# ──────────────────────────────────────────
+"""
+frappe.call("eseller_suite.eseller_suite.doctype.amazon_sp_api_settings.amazon_sync_fba_inventory.run_daily_fba_inventory_sync")
+Outside the 7 AM Pacific hour this call returns without syncing unless DEBUG is on or
+FBA_SYNC_ANY_HOUR=1 is set in the environment; process_fba_inventory() always runs.
+
+NOTE:
+You need to Manually Create Opening Stock Entries Before Running the Initial Sync
+Go to Stock > Stock Transactions > Stock Entry > New
+Set Stock Entry Type to "Material Receipt"
+Set Target Warehouse to your relevant warehouses (Amazon FBA, Amazon FBA Inbound, Amazon FBA Prep Area
+"""
+@frappe.whitelist()
+def run_daily_fba_inventory_sync():
+    """Hourly (long queue) scheduler entry: sync FBA inventory, only in the 7 AM Pacific hour."""
+    any_hour = DEBUG or os.environ.get(SYNC_ANY_HOUR_ENV) == "1"
+    if not any_hour and datetime.now(SYNC_TZ).hour != SYNC_HOUR:
+        return
+    try:  # ADDED: Wrap scheduler call
+        settings = frappe.get_cached_doc("Amazon SP API Settings", "q3opu7c5ac")  # Load to ensure active
+        process_fba_inventory(settings)
+    except Exception:
+        frappe.log_error(frappe.get_traceback(), "Daily FBA Inventory Sync Error")
         raise
\ No newline at end of file
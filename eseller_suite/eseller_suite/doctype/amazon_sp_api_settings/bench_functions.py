@@ -4,46 +4,203 @@
 import frappe
 from frappe.utils import now
 #-------------------------------------------------------------------------------------------------------------------------------------------------------Accounting
+#--------------------------------------------
+#Progress is printed once per this many rows, not per row
+#--------------------------------------------
+# PROGRESS_EVERY = 1000
+
+
+#--------------------------------------------
+#delete_doc options for the mass wipes: skip permission checks, on_trash hooks and
+#the Deleted Document backup of every row
+#--------------------------------------------
+# MASS_DELETE_FLAGS = {
+#     "force": True,
+#     "ignore_permissions": True,
+#     "ignore_on_trash": True,
+#     "delete_permanently": True,
+# }
+
+
+#--------------------------------------------
+#Shared helper: delete rows by name in chunks
+#--------------------------------------------
+# def bulk_delete_names(doctype, names, chunk_size=5000, commit_every=10):
+#     """
+#     Deletes `names` from `tab{doctype}` with one DELETE ... WHERE name IN (...) per
+#     `chunk_size` names, committing every `commit_every` chunks.
+#     Raw SQL: no hooks and no child-table cleanup, so only use it on ledger-style
+#     tables without child rows (GL Entry, Payment Ledger Entry, Bin, ...).
+#     """
+#     total = len(names)
+#     deleted = 0
+#     for idx, start in enumerate(range(0, total, chunk_size), start=1):
+#         chunk = names[start:start + chunk_size]
+#         frappe.db.sql(f"DELETE FROM `tab{doctype}` WHERE name IN %(names)s", {"names": tuple(chunk)})
+#         deleted += len(chunk)
+#         if idx % commit_every == 0:
+#             frappe.db.commit()
+#             print(f"[{deleted}/{total}] Deleted {doctype} rows…")
+#     frappe.db.commit()
+#     return deleted
+
+
+#--------------------------------------------
+#Shared helper: page through names without loading them all
+#--------------------------------------------
+# def iter_name_chunks(doctype, chunk_size=10000):
+#     """
+#     Yields lists of up to `chunk_size` names from `tab{doctype}`, keyset-paged on
+#     name, so only one page is held in memory. Safe to delete each page before
+#     asking for the next one.
+#     """
+#     last_name = ""
+#     while True:
+#         names = frappe.db.sql_list(
+#             f"SELECT name FROM `tab{doctype}` WHERE name > %s ORDER BY name LIMIT {int(chunk_size)}",
+#             (last_name,),
+#         )
+#         if not names:
+#             return
+#         last_name = names[-1]
+#         yield names
+
+
+#--------------------------------------------
+#Shared helper: raw delete of parents and their child-table rows
+#--------------------------------------------
+# def delete_with_children(doctype, names):
+#     """
+#     Deletes `names` from `tab{doctype}` and every child table of the doctype with one
+#     DELETE per child table and one for the parents. Raw SQL: no hooks, no linked-doc
+#     checks, no ledger reversal. Does not commit; the caller decides when to.
+#     """
+#     if not names:
+#         return 0
+# 
+#     params = {"parenttype": doctype, "names": tuple(names)}
+#     for df in frappe.get_meta(doctype).get_table_fields():
+#         frappe.db.sql(
+#             f"DELETE FROM `tab{df.options}` WHERE parenttype = %(parenttype)s AND parent IN %(names)s",
+#             params,
+#         )
+#     frappe.db.sql(f"DELETE FROM `tab{doctype}` WHERE name IN %(names)s", params)
+#     return len(names)
+
+
+#--------------------------------------------
+#Shared helper: delete rows by creation range
+#--------------------------------------------
+# def delete_by_creation_range(doctype, limit=20000, truncate=False):
+#     """
+#     Deletes every row of `tab{doctype}` by walking `creation` in time windows,
+#     committing after each window. Walks the creation index as a contiguous range
+#     instead of resolving a list of names, so nothing is loaded up front.
+#     The window grows while windows come back small and shrinks when a window
+#     fills the LIMIT (that window is simply re-run until it is empty).
+#     Raw SQL: same caveats as bulk_delete_names.
+#     truncate=True empties the table with TRUNCATE TABLE instead (implicit commit,
+#     no per-row work); only pass it when the whole table is meant to go.
+#     """
+#     from datetime import timedelta
+# 
+#     if truncate:
+#         count = frappe.db.count(doctype)
+#         frappe.db.truncate(doctype)
+#         frappe.db.commit()
+#         return count
+# 
+#     bounds = frappe.db.sql(f"SELECT MIN(creation), MAX(creation) FROM `tab{doctype}`")
+#     lo, hi = bounds[0] if bounds else (None, None)
+#     if lo is None:
+#         return 0
+# 
+#     small, large = timedelta(minutes=5), timedelta(hours=1)
+#     stride = large
+#     deleted = 0
+#     while lo <= hi:
+#         upper = lo + stride
+#         frappe.db.sql(
+#             f"DELETE FROM `tab{doctype}` WHERE creation >= %s AND creation < %s LIMIT {int(limit)}",
+#             (lo, upper),
+#         )
+#         count = frappe.db._cursor.rowcount
+#         frappe.db.commit()
+#         deleted += count
+#         print(f"[{lo} – {upper}] Deleted {count} {doctype} rows ({deleted} so far)…")
+#         if count >= limit:
+#             # Window still has rows; stay on it with a tighter stride
+#             stride = small
+#             continue
+#         lo = upper
+#         stride = small if count > limit // 2 else large
+#     return deleted
+
+
+#--------------------------------------------
+#Shared helper: delete_doc across worker threads
+#--------------------------------------------
+# def parallel_delete_docs(doctype, names, workers=1, chunk_size=500):
+#     """
+#     Runs frappe.delete_doc(**MASS_DELETE_FLAGS) over `names`. With workers=1 it runs inline
+#     on the current connection; otherwise chunks of `chunk_size` names are handed to
+#     a ThreadPoolExecutor and every worker opens its own site connection, since
+#     frappe.db is not shared between threads. Each chunk commits on its own.
+#     """
+#     from concurrent.futures import ThreadPoolExecutor, as_completed
+# 
+#     site, user = frappe.local.site, frappe.session.user
+#     total = len(names)
+#     chunks = [names[i:i + chunk_size] for i in range(0, total, chunk_size)]
+# 
+#     def _delete_chunk(chunk):
+#         failed = 0
+#         for name in chunk:
+#             try:
+#                 frappe.delete_doc(doctype, name, **MASS_DELETE_FLAGS)
+#             except Exception as e:
+#                 failed += 1
+#                 print(f"Error deleting {doctype} {name}: {e}")
+#         frappe.db.commit()
+#         return len(chunk) - failed
+# 
+#     def _worker(chunk):
+#         frappe.init(site=site)
+#         frappe.connect()
+#         frappe.set_user(user)
+#         try:
+#             return _delete_chunk(chunk)
+#         finally:
+#             frappe.destroy()
+# 
+#     deleted = 0
+#     if workers <= 1:
+#         for chunk in chunks:
+#             deleted += _delete_chunk(chunk)
+#             print(f"[{deleted}/{total}] Deleted {doctype} documents…")
+#         return deleted
+# 
+#     with ThreadPoolExecutor(max_workers=workers) as pool:
+#         for future in as_completed(pool.submit(_worker, chunk) for chunk in chunks):
+#             deleted += future.result()
+#             print(f"[{deleted}/{total}] Deleted {doctype} documents…")
+#     return deleted
+
+
 #--------------------------------------------
 #Delete all general ledger entries
 #-------------------------------------------- 
 """
 frappe.call("eseller_suite.eseller_suite.doctype.amazon_sp_api_settings.bench_functions.delete_all_gl_entries")
 """
-# def delete_all_gl_entries():
-#     """Deletes every GL Entry in the system with periodic commits."""
-#     # Fetch every GL Entry name
-#     gle_names = frappe.get_all("GL Entry", pluck="name")
-#     total = len(gle_names)
-# 
-#     if not total:
+# def delete_all_gl_entries(truncate=False):
+#     """Deletes every GL Entry in the system, one creation window at a time."""
+#     deleted = delete_by_creation_range("GL Entry", truncate=truncate)
+#     if not deleted:
 #         print("No GL Entries found.")
 #         return
 # 
-#     print(f"Found {total} GL Entries; deleting now…")
-# 
-#     commit_interval = 10000
-# 
-#     # Loop through and delete each one
-#     for idx, name in enumerate(gle_names, start=1):
-#         try:
-#             frappe.delete_doc(
-#                 "GL Entry",
-#                 name,
-#                 force=True,            # bypass Submitted / linked-doc checks
-#                 ignore_permissions=True
-#             )
-#             print(f"[{idx}/{total}] Deleted GL Entry {name}")
-#         except Exception as e:
-#             print(f"[{idx}/{total}] FAILED to delete {name}: {e}")
-# 
-#         if idx % commit_interval == 0:
-#             frappe.db.commit()
-#             print(f"Committed after {idx} deletions…")
-# 
-#     # Final commit for any remaining changes
-#     frappe.db.commit()
-#     print(f"Finished. Attempted deletion of {total} GL Entries.")
+#     print(f"Finished. Deleted {deleted} GL Entries.")
 
 
 #--------------------------------------------
@@ -95,31 +252,13 @@ frappe.call("eseller_suite.eseller_suite.doctype.amazon_sp_api_settings.bench_fu
 """
 frappe.call("eseller_suite.eseller_suite.doctype.amazon_sp_api_settings.bench_functions.delete_all_payment_ledger_entries")
 """
-# def delete_all_payment_ledger_entries():
+# def delete_all_payment_ledger_entries(truncate=False):
 #     """Deletes every Payment Ledger Entry in the system."""
-#     # Fetch every Payment Ledger Entry name
-#     ple_names = frappe.get_all("Payment Ledger Entry", pluck="name")
-#     total = len(ple_names)
-# 
-#     if not total:
+#     deleted = delete_by_creation_range("Payment Ledger Entry", truncate=truncate)
+#     if not deleted:
 #         return "No Payment Ledger Entry rows found."
 # 
-#     # Loop and delete with periodic commits
-#     commit_interval = 10000
-#     for idx, name in enumerate(ple_names, start=1):
-#         frappe.delete_doc(
-#             "Payment Ledger Entry",
-#             name,
-#             force=True,           # bypass Submitted / linked-doc checks
-#             ignore_permissions=True
-#         )
-#         print(f"[{idx}/{total}] Deleted Payment Ledger Entry {name}")
-#         if idx % commit_interval == 0:
-#             frappe.db.commit()
-# 
-#     # Final commit for any remaining changes
-#     frappe.db.commit()
-#     return f"Deleted {total} Payment Ledger Entry rows."
+#     return f"Deleted {deleted} Payment Ledger Entry rows."
 
 
 #--------------------------------------------
@@ -128,24 +267,14 @@ frappe.call("eseller_suite.eseller_suite.doctype.amazon_sp_api_settings.bench_fu
 """
 frappe.call("eseller_suite.eseller_suite.doctype.amazon_sp_api_settings.bench_functions.delete_all_journal_entries")
 """
-# def delete_all_journal_entries():
-#     entries = frappe.get_all('Journal Entry', fields=['name'])  # , filters={'owner': frappe.session.user}
-# 
-#     for entry in entries:
-#         name = entry['name']
-#         try:
-#             # Forcefully delete the document, even if submitted (skips cancel step)
-#             # Since you've already deleted GL and payment ledger entries, this assumes no need for reversal
-#             frappe.delete_doc('Journal Entry', name, force=True, ignore_permissions=True)
-#             
-#             print(f"Successfully deleted Journal Entry: {name}")
-#         except Exception as e:
-#             print(f"Error deleting Journal Entry {name}: {str(e)}")
+# def delete_all_journal_entries(workers=1):
+#     entries = frappe.get_all('Journal Entry', pluck='name')  # , filters={'owner': frappe.session.user}
 # 
-#     # Commit all changes to the database
-#     frappe.db.commit()
+#     # Forcefully delete the documents, even if submitted (skips cancel step)
+#     # Since you've already deleted GL and payment ledger entries, this assumes no need for reversal
+#     deleted = parallel_delete_docs('Journal Entry', entries, workers=workers)
 # 
-#     print("All Journal Entries deleted.")
+#     print(f"All Journal Entries deleted ({deleted}/{len(entries)}).")
 
 
 #--------------------------------------------
@@ -175,7 +304,7 @@ frappe.call("eseller_suite.eseller_suite.doctype.amazon_sp_api_settings.bench_fu
 """
 frappe.call("eseller_suite.eseller_suite.doctype.amazon_sp_api_settings.bench_functions.delete_all_payment_entries")
 """
-# def delete_all_payment_entries():
+# def delete_all_payment_entries(commit_every=500):
 #     # Get all Payment Entries
 #     payment_entries = frappe.get_all("Payment Entry", fields=["name"])
 #     total = len(payment_entries)
@@ -184,15 +313,21 @@ frappe.call("eseller_suite.eseller_suite.doctype.amazon_sp_api_settings.bench_fu
 #     frappe.db.sql("UPDATE `tabPayment Entry` SET docstatus = 0")
 #     frappe.db.commit()
 # 
-#     # Delete each one with progress
+#     # Delete each one with progress, committing every `commit_every` rows
 #     for i, pe in enumerate(payment_entries, 1):
 #         name = pe.name
 #         try:
-#             frappe.delete_doc("Payment Entry", name, force=1, ignore_permissions=True)
-#             frappe.db.commit()
-#             print(f"Deleted {name} ({i}/{total})")
+#             frappe.delete_doc("Payment Entry", name, **MASS_DELETE_FLAGS)
 #         except Exception as e:
 #             print(f"Error deleting {name}: {str(e)} ({i}/{total})")
+# 
+#         if i % commit_every == 0:
+#             frappe.db.commit()
+#         if i % PROGRESS_EVERY == 0:
+#             print(f"[{i}/{total}] Deleted…")
+# 
+#     # Final commit for any remaining changes
+#     frappe.db.commit()
 
 #--------------------------------------------
 #Force a submitted journal entry back into draft state (makes deleting easier for large scale journal entries)
@@ -203,15 +338,13 @@ frappe.call("eseller_suite.eseller_suite.doctype.amazon_sp_api_settings.bench_fu
 # def force_unsubmit_journal_entry(jv_name):
 #     # Optional: Handle linked GL Entries first
 #     frappe.db.delete("GL Entry", {"voucher_type": "Journal Entry", "voucher_no": jv_name})
-#     
+# 
 #     # Force docstatus to 0 (draft)
 #     frappe.db.sql("""UPDATE `tabJournal Entry` SET docstatus = 0 WHERE name = %s""", jv_name)
 #     frappe.db.commit()
-#     
-#     # Reload the document to reflect changes
-#     jv = frappe.get_doc("Journal Entry", jv_name)
-#     jv.reload()
-#     print(f"Journal Entry {jv_name} set to draft.")
+# 
+#     docstatus = frappe.db.get_value("Journal Entry", jv_name, "docstatus")
+#     print(f"Journal Entry {jv_name} set to draft (docstatus={docstatus}).")
 
 #--------------------------------------------
 #Force a all submitted journal entries back into draft state
@@ -220,18 +353,11 @@ frappe.call("eseller_suite.eseller_suite.doctype.amazon_sp_api_settings.bench_fu
 frappe.call("eseller_suite.eseller_suite.doctype.amazon_sp_api_settings.bench_functions.force_unsubmit_all_journal_entries")
 """
 # def force_unsubmit_all_journal_entries():
-#     # Get all submitted Journal Entries (docstatus=1)
-#     jv_names = frappe.db.get_all("Journal Entry", filters={"docstatus": 1}, fields=["name"], pluck="name")
-#     
-#     for jv_name in jv_names:
-#         # Force docstatus to 0 (draft)
-#         frappe.db.sql("""UPDATE `tabJournal Entry` SET docstatus = 0 WHERE name = %s""", jv_name)
-#         frappe.db.commit()
-#         
-#         # Reload the document to reflect changes
-#         jv = frappe.get_doc("Journal Entry", jv_name)
-#         jv.reload()
-#         print(f"Journal Entry {jv_name} set to draft.")
+#     # Force every submitted Journal Entry (docstatus=1) to draft in one statement
+#     frappe.db.sql("""UPDATE `tabJournal Entry` SET docstatus = 0 WHERE docstatus = 1""")
+#     count = frappe.db._cursor.rowcount
+#     frappe.db.commit()
+#     print(f"{count} Journal Entries set to draft.")
     
 #--------------------------------------------
 #Delete all journal entries, payment entries and general ledger entries
@@ -239,11 +365,46 @@ frappe.call("eseller_suite.eseller_suite.doctype.amazon_sp_api_settings.bench_fu
 """
 frappe.call("eseller_suite.eseller_suite.doctype.amazon_sp_api_settings.bench_functions.delete_all_journal_entries_and_data")
 """
-# def delete_all_journal_entries_and_data():
-#     delete_all_payment_ledger_entries()
-#     delete_all_gl_entries()
-#     force_unsubmit_all_journal_entries()
-#     delete_all_journal_entries()
+# def delete_all_journal_entries_and_data(dry_run=False):
+#     """
+#     Wipes Payment Ledger Entries, GL Entries and Journal Entries in one transaction
+#     with a single commit at the end (the delete_all_* helpers commit as they go, so
+#     they are not reused here). Each step runs under its own savepoint: a failing step
+#     is rolled back on its own and the steps before it are still committed.
+#     dry_run=True runs everything, prints the counts and rolls it all back.
+#     """
+#     def _run(sql):
+#         frappe.db.sql(sql)
+#         return frappe.db._cursor.rowcount
+# 
+#     def _delete_journal_entries():
+#         names = frappe.get_all("Journal Entry", pluck="name")
+#         for start in range(0, len(names), 5000):
+#             delete_with_children("Journal Entry", names[start:start + 5000])
+#         return len(names)
+# 
+#     steps = [
+#         ("payment_ledger", lambda: _run("DELETE FROM `tabPayment Ledger Entry`")),
+#         ("gl_entries", lambda: _run("DELETE FROM `tabGL Entry`")),
+#         ("unsubmit_journal_entries", lambda: _run("UPDATE `tabJournal Entry` SET docstatus = 0 WHERE docstatus = 1")),
+#         ("journal_entries", _delete_journal_entries),
+#     ]
+# 
+#     for label, step in steps:
+#         frappe.db.savepoint(label)
+#         try:
+#             count = step()
+#         except Exception as e:
+#             frappe.db.rollback(save_point=label)
+#             print(f"[{label}] failed, rolled back this step: {e}")
+#             break
+#         print(f"[{label}] {count} rows")
+# 
+#     if dry_run:
+#         frappe.db.rollback()
+#         print("Dry run: rolled back.")
+#     else:
+#         frappe.db.commit()
     
 
 
@@ -281,38 +442,17 @@ frappe.call("eseller_suite.eseller_suite.doctype.amazon_sp_api_settings.bench_fu
 """
 # def delete_all_bin_entries():
 #     """
-#     Delete every Bin document in the system, showing progress as (deleted/total).
+#     Delete every Bin document in the system in chunked DELETEs, showing progress.
 #     """
-#     # Count how many Bin records exist before we start
-#     total_bins = frappe.db.count("Bin")
-#     if total_bins == 0:
+#     deleted = 0
+#     for bin_names in iter_name_chunks("Bin"):
+#         deleted += bulk_delete_names("Bin", bin_names)
+# 
+#     if not deleted:
 #         print("No Bin entries found.")
 #         return
 # 
-#     batch_size = 100
-#     deleted_so_far = 0
-# 
-#     while True:
-#         # Fetch a batch of Bin names
-#         bin_names = frappe.db.sql(
-#             "SELECT name FROM `tabBin` LIMIT %s",
-#             batch_size,
-#             as_dict=True
-#         )
-#         if not bin_names:
-#             break
-# 
-#         for b in bin_names:
-#             frappe.delete_doc(
-#                 "Bin",
-#                 b.name,
-#                 ignore_permissions=True,
-#                 force=True
-#             )
-#             deleted_so_far += 1
-#             print(f"Deleted Bin: {b.name} ({deleted_so_far}/{total_bins})")
-# 
-#         frappe.db.commit()  # commit after each batch
+#     print(f"Deleted {deleted} Bin entries.")
         
 #--------------------------------------------
 # Delete all stock ledger entries
@@ -320,37 +460,13 @@ frappe.call("eseller_suite.eseller_suite.doctype.amazon_sp_api_settings.bench_fu
 """
 frappe.call("eseller_suite.eseller_suite.doctype.amazon_sp_api_settings.bench_functions.delete_all_stock_ledger_entries")
 """
-# def delete_all_stock_ledger_entries():
-#     # Get the total count once, before we start deleting
-#     total_sle = frappe.db.count("Stock Ledger Entry")
-#     if total_sle == 0:
+# def delete_all_stock_ledger_entries(truncate=False):
+#     deleted = delete_by_creation_range("Stock Ledger Entry", truncate=truncate)
+#     if not deleted:
 #         print("No Stock Ledger Entries found.")
 #         return
 # 
-#     batch_size = 100
-#     deleted_so_far = 0
-# 
-#     while True:
-#         # Grab a batch of names to delete
-#         sle_names = frappe.db.sql(
-#             "SELECT name FROM `tabStock Ledger Entry` LIMIT %s",
-#             batch_size,
-#             as_dict=True
-#         )
-#         if not sle_names:
-#             break
-# 
-#         for sle in sle_names:
-#             frappe.delete_doc(
-#                 "Stock Ledger Entry",
-#                 sle.name,
-#                 ignore_permissions=True,
-#                 force=True
-#             )
-#             deleted_so_far += 1
-#             print(f"Deleted Stock Ledger Entry: {sle.name} ({deleted_so_far}/{total_sle})")
-# 
-#         frappe.db.commit()  # commit after each batch
+#     print(f"Deleted {deleted} Stock Ledger Entries.")
 
 #--------------------------------------------
 # Delete all stock entries
@@ -359,17 +475,12 @@ frappe.call("eseller_suite.eseller_suite.doctype.amazon_sp_api_settings.bench_fu
 frappe.call("eseller_suite.eseller_suite.doctype.amazon_sp_api_settings.bench_functions.delete_all_stock_entries")
 """
 # def delete_all_stock_entries():
-#     batch_size = 100
-#     while True:
-#         # Fetch a batch of Stock Entry names
-#         se_names = frappe.db.sql("SELECT name FROM `tabStock Entry` LIMIT %s", batch_size, as_dict=True)
-#         if not se_names:
-#             break
-#         for se in se_names:
-#             frappe.db.set_value("Stock Entry", se.name, "docstatus", 0)
-#             frappe.delete_doc("Stock Entry", se.name, ignore_permissions=True, force=True)
-#             print(f"Deleted Stock Entry: {se.name}")
+#     deleted = 0
+#     # Delete Stock Entries and their child rows a page at a time
+#     for se_names in iter_name_chunks("Stock Entry", chunk_size=5000):
+#         deleted += delete_with_children("Stock Entry", se_names)
 #         frappe.db.commit()  # Commit after each batch
+#         print(f"Deleted {deleted} Stock Entry documents…")
 
 #--------------------------------------------
 # Delete a specific stock entry
@@ -391,17 +502,23 @@ frappe.call("eseller_suite.eseller_suite.doctype.amazon_sp_api_settings.bench_fu
 frappe.call("eseller_suite.eseller_suite.doctype.amazon_sp_api_settings.bench_functions.delete_all_job_cards")
 """
 # def delete_all_job_cards():
-#     batch_size = 100
+#     batch_size = 5000
+#     last_name = ""
 #     while True:
-#         # Fetch a batch of Job Card names
-#         jc_names = frappe.db.sql("SELECT name FROM `tabJob Card` LIMIT %s", batch_size, as_dict=True)
+#         # Fetch the next page of Job Card names after the last one seen
+#         jc_names = frappe.db.sql(
+#             "SELECT name FROM `tabJob Card` WHERE name > %s ORDER BY name LIMIT %s",
+#             (last_name, batch_size),
+#             as_dict=True,
+#         )
 #         if not jc_names:
 #             break
+#         last_name = jc_names[-1].name
 #         for jc in jc_names:
 #             frappe.db.set_value("Job Card", jc.name, "docstatus", 0)
-#             frappe.delete_doc("Job Card", jc.name, ignore_permissions=True, force=True)
-#             print(f"Deleted Job Card: {jc.name}")
+#             frappe.delete_doc("Job Card", jc.name, **MASS_DELETE_FLAGS)
 #         frappe.db.commit()  # Commit after each batch
+#         print(f"Deleted {len(jc_names)} Job Card documents up to {last_name}")
         
 #--------------------------------------------
  #Delete all work orders
@@ -410,12 +527,10 @@ frappe.call("eseller_suite.eseller_suite.doctype.amazon_sp_api_settings.bench_fu
 frappe.call("eseller_suite.eseller_suite.doctype.amazon_sp_api_settings.bench_functions.delete_all_work_orders")
 """
 # def delete_all_work_orders():
-#     work_orders = frappe.get_all("Work Order", fields=["name"])
-#     total = len(work_orders)
-#     for i, wo in enumerate(work_orders, 1):
-#         frappe.db.sql("""UPDATE `tabWork Order` SET docstatus = 0 WHERE name = %s""", wo.name)
-#         frappe.delete_doc("Work Order", wo.name)
-#         print(f"Deleted {wo.name} ({i}/{total})")
+#     deleted = 0
+#     for wo_names in iter_name_chunks("Work Order", chunk_size=5000):
+#         deleted += delete_with_children("Work Order", wo_names)
+#         print(f"Deleted {deleted} Work Orders…")
 #     frappe.db.commit()
 
 #-------------------------------------------------------------------------------------------------------------------------------------------------------Sales Orders
@@ -478,37 +593,46 @@ def force_so_to_draft(so_name: str):
 """
 frappe.call("eseller_suite.eseller_suite.doctype.amazon_sp_api_settings.bench_functions.delete_all_sales_orders")
 """
-# def delete_all_sales_orders():
-#     # Get all Sales Orders
-#     sales_orders = frappe.get_all("Sales Order", fields=["name"])
-#     total = len(sales_orders)
-# 
-#     # Set all to draft (docstatus=0)
-#     frappe.db.sql("UPDATE `tabSales Order` SET docstatus = 0")
-#     frappe.db.commit()
-# 
-#     # Delete each one with progress
-#     for i, so in enumerate(sales_orders, 1):
-#         name = so.name
-#         try:
-#             frappe.delete_doc("Sales Order", name, force=1, ignore_permissions=True)
-#             frappe.db.commit()
-#             print(f"Deleted {name} ({i}/{total})")
-#         except Exception as e:
-#             print(f"Error deleting {name}: {str(e)} ({i}/{total})")
+# def delete_all_sales_orders(commit_every=500):
+#     # Delete Sales Orders and their child rows a page at a time, committing per page.
+#     # Docstatus does not matter to a raw DELETE, so no draft reset is needed
+#     deleted = 0
+#     for so_names in iter_name_chunks("Sales Order", chunk_size=commit_every):
+#         deleted += delete_with_children("Sales Order", so_names)
+#         frappe.db.commit()
+#         print(f"Deleted {deleted} Sales Orders…")
     
             
 """
 frappe.call("eseller_suite.eseller_suite.doctype.amazon_sp_api_settings.amazon_sp_api_settings.print_all_sales_orders")
 """
 # def print_all_sales_orders():
+#     from collections import defaultdict
+# 
 #     # Fetch all Sales Orders with all fields
 #     sales_orders = frappe.get_all("Sales Order", fields=["*"], order_by="name")
-#     
+# 
 #     if not sales_orders:
 #         print("No Sales Orders found.")
 #         return
-#     
+# 
+#     # Fetch the child rows of every Sales Order in one query per child table
+#     items_by_so = defaultdict(list)
+#     for item in frappe.db.sql(
+#         """SELECT parent, item_code, qty, amount FROM `tabSales Order Item`
+#            WHERE parenttype = 'Sales Order' ORDER BY parent, idx""",
+#         as_dict=True,
+#     ):
+#         items_by_so[item.parent].append(item)
+# 
+#     taxes_by_so = defaultdict(list)
+#     for tax in frappe.db.sql(
+#         """SELECT parent, account_head, tax_amount FROM `tabSales Taxes and Charges`
+#            WHERE parenttype = 'Sales Order' ORDER BY parent, idx""",
+#         as_dict=True,
+#     ):
+#         taxes_by_so[tax.parent].append(tax)
+# 
 #     for so in sales_orders:
 #         # Print the basic details
 #         print(f"\nSales Order: {so.name}")
@@ -516,17 +640,15 @@ frappe.call("eseller_suite.eseller_suite.doctype.amazon_sp_api_settings.amazon_s
 #         for key, value in so.items():
 #             print(f"{key}: {value}")
 #         print("-" * 40)
-#         
-#         # Optionally, fetch and print child tables if needed (e.g., items, taxes)
-#         full_doc = frappe.get_doc("Sales Order", so.name)
-#         if full_doc.items:
+# 
+#         if items_by_so[so.name]:
 #             print("Items:")
-#             for item in full_doc.items:
+#             for item in items_by_so[so.name]:
 #                 print(f"  - Item Code: {item.item_code}, Qty: {item.qty}, Amount: {item.amount}")
-#         
-#         if full_doc.taxes:
+# 
+#         if taxes_by_so[so.name]:
 #             print("Taxes:")
-#             for tax in full_doc.taxes:
+#             for tax in taxes_by_so[so.name]:
 #                 print(f"  - Account: {tax.account_head}, Amount: {tax.tax_amount}")
             
 #-------------------------------------------------------------------------------------------------------------------------------------------------------Sales Invoices
@@ -536,23 +658,18 @@ frappe.call("eseller_suite.eseller_suite.doctype.amazon_sp_api_settings.amazon_s
 """
 frappe.call("eseller_suite.eseller_suite.doctype.amazon_sp_api_settings.bench_functions.delete_all_sales_invoices")
 """
-# def delete_all_sales_invoices():
-#     # Get all s
-#     sales_invoices = frappe.get_all("Sales Invoice", fields=["name"])
-#     total = len(sales_invoices)
+# def delete_all_sales_invoices(workers=1):
+#     # Get all Sales Invoices
+#     si_names = frappe.get_all("Sales Invoice", pluck="name")
+#     total = len(si_names)
 # 
 #     # Set all to draft (docstatus=0)
 #     frappe.db.sql("UPDATE `tabSales Invoice` SET docstatus = 0")
 #     frappe.db.commit()
 # 
-#     # Delete each one with progress
-#     for i, si in enumerate(sales_invoices, 1):
-#         name = si.name
-#         try:
-#             frappe.delete_doc("Sales Invoice", name, force=1, ignore_permissions=True)
-#             print(f"Deleted {name} ({i}/{total})")
-#         except Exception as e:
-#             print(f"Error deleting {name}: {str(e)} ({i}/{total})")
+#     # Delete in chunks, optionally across `workers` connections
+#     deleted = parallel_delete_docs("Sales Invoice", si_names, workers=workers)
+#     print(f"Deleted {deleted} of {total} Sales Invoices.")
             
 #--------------------------------------------
  #Delete all sales invoices that are in status "Return"
@@ -572,13 +689,9 @@ frappe.call("eseller_suite.eseller_suite.doctype.amazon_sp_api_settings.bench_fu
 #     for idx, name in enumerate(si_names, start=1):
 #         # Set Sales Invoice to Draft
 #         frappe.db.set_value("Sales Invoice", name, "docstatus", 0)
-#         frappe.delete_doc(
-#             "Sales Invoice",
-#             name,
-#             force=True,  # bypass Submitted / linked-doc checks
-#             ignore_permissions=True
-#         )
-#         print(f"[{idx}/{total}] Set to Draft and Deleted Sales Invoice {name}")
+#         frappe.delete_doc("Sales Invoice", name, **MASS_DELETE_FLAGS)
+#         if idx % PROGRESS_EVERY == 0:
+#             print(f"[{idx}/{total}] Set to Draft and Deleted Sales Invoices…")
 #         if idx % commit_interval == 0:
 #             frappe.db.commit()
 #     # Final commit for any remaining changes
@@ -594,17 +707,23 @@ frappe.call("eseller_suite.eseller_suite.doctype.amazon_sp_api_settings.bench_fu
 frappe.call("eseller_suite.eseller_suite.doctype.amazon_sp_api_settings.bench_functions.delete_all_repost_item_valuation_entries")
 """
 # def delete_all_repost_item_valuation_entries():
-#     batch_size = 100
+#     batch_size = 5000
+#     last_name = ""
 #     while True:
-#         # Fetch a batch of Repost Item Valuation names
-#         riv_names = frappe.db.sql("SELECT name FROM `tabRepost Item Valuation` LIMIT %s", batch_size, as_dict=True)
+#         # Fetch the next page of Repost Item Valuation names after the last one seen
+#         riv_names = frappe.db.sql(
+#             "SELECT name FROM `tabRepost Item Valuation` WHERE name > %s ORDER BY name LIMIT %s",
+#             (last_name, batch_size),
+#             as_dict=True,
+#         )
 #         if not riv_names:
 #             break
+#         last_name = riv_names[-1].name
 #         for riv in riv_names:
 #             frappe.db.set_value("Repost Item Valuation", riv.name, "docstatus", 0)
-#             frappe.delete_doc("Repost Item Valuation", riv.name, ignore_permissions=True, force=True)
-#             print(f"Deleted Repost Item Valuation: {riv.name}")
+#             frappe.delete_doc("Repost Item Valuation", riv.name, **MASS_DELETE_FLAGS)
 #         frappe.db.commit()  # Commit after each batch
+#         print(f"Deleted {len(riv_names)} Repost Item Valuation documents up to {last_name}")
 
 #--------------------------------------------
  #Delete all inventory from specific warehouse
@@ -613,18 +732,13 @@ frappe.call("eseller_suite.eseller_suite.doctype.amazon_sp_api_settings.bench_fu
 frappe.call("eseller_suite.eseller_suite.doctype.amazon_sp_api_settings.bench_functions.delete_inventory_from_warehouse", warehouse="Main Warehouse - CC")
 """
 # def delete_inventory_from_warehouse(warehouse):
-#     # Get all unique items in the warehouse
-#     items = frappe.db.get_list("Bin", filters={"warehouse": warehouse}, fields=["item_code"], pluck="item_code")
-#     total = len(items)
-#     for i, item_code in enumerate(items, 1):
-#         # Delete Stock Ledger Entries for this item and warehouse
-#         frappe.db.sql("""DELETE FROM `tabStock Ledger Entry` WHERE warehouse = %s AND item_code = %s""", (warehouse, item_code))
-#         # Delete Bin for this item and warehouse
-#         bin_name = frappe.db.get_value("Bin", {"warehouse": warehouse, "item_code": item_code})
-#         if bin_name:
-#             frappe.db.delete("Bin", bin_name)
-#         print(f"Deleted {item_code} ({i}/{total})")
+#     # Delete every Stock Ledger Entry and Bin for the warehouse in one statement each
+#     frappe.db.sql("""DELETE FROM `tabStock Ledger Entry` WHERE warehouse = %s""", warehouse)
+#     sle_count = frappe.db._cursor.rowcount
+#     frappe.db.sql("""DELETE FROM `tabBin` WHERE warehouse = %s""", warehouse)
+#     bin_count = frappe.db._cursor.rowcount
 #     frappe.db.commit()
+#     print(f"Deleted {sle_count} Stock Ledger Entries and {bin_count} Bins from {warehouse}")
 
 #-------------------------------------------------------------------------------------------------------------------------------------------------------Bill of Material (BOM)
 #--------------------------------------------
@@ -633,16 +747,19 @@ frappe.call("eseller_suite.eseller_suite.doctype.amazon_sp_api_settings.bench_fu
 """
 frappe.call("eseller_suite.eseller_suite.doctype.amazon_sp_api_settings.bench_functions.force_set_bom_to_draft", bom_name="BOM-FO-CC30CALPIS1")
 """
-# def force_set_bom_to_draft(bom_name: str) -> None:
+# def force_set_bom_to_draft(bom_name: str, user: str | None = None, ts: str | None = None) -> None:
 # 
 #     """
 #     Forcefully set a BOM's docstatus to Draft (0), regardless of current state.
 #     Prints step-by-step operations and exits cleanly if already draft.
+#     When looping over many BOMs, resolve `user` and `ts` once and pass them in.
 # 
 #     WARNING:
 #         This bypasses normal ERPNext workflow (submit/cancel/amend).
 #         Use with caution and only if you know the implications for linked records.
 #     """
+#     user = user or frappe.session.user or "Administrator"
+#     ts = ts or now()
 #     print(f"[start] Preparing to force-set BOM '{bom_name}' to Draft…")
 # 
 #     # Fetch the BOM
@@ -666,7 +783,7 @@ frappe.call("eseller_suite.eseller_suite.doctype.amazon_sp_api_settings.bench_fu
 #         """UPDATE `tabBOM`
 #            SET docstatus = 0, modified = %s, modified_by = %s
 #            WHERE name = %s""",
-#         (now(), frappe.session.user if frappe.session.user else "Administrator", bom.name),
+#         (ts, user, bom.name),
 #     )
 # 
 #     # Commit and verify
@@ -689,36 +806,15 @@ frappe.call("eseller_suite.eseller_suite.doctype.amazon_sp_api_settings.bench_fu
 """
 # def delete_all_advance_payment_ledger_entries():
 #     """Deletes every Advance Payment Ledger Entry in the system."""
-#     # Fetch every APLE name
-#     aple_names = frappe.get_all("Advance Payment Ledger Entry", pluck="name")
-#     total = len(aple_names)
+#     # Page through APLE names and delete each page as it arrives.
+#     # Raw DELETE removes submitted rows too, so no docstatus reset is needed
+#     total = 0
+#     for aple_names in iter_name_chunks("Advance Payment Ledger Entry"):
+#         total += bulk_delete_names("Advance Payment Ledger Entry", aple_names)
 # 
 #     if not total:
 #         return "No Advance Payment Ledger Entry rows found."
 # 
-#     # Loop and delete with periodic commits
-#     commit_interval = 10000
-#     for idx, name in enumerate(aple_names, start=1):
-#         # Some ledger tables may have docstatus; make sure it's cancelable if needed
-#         try:
-#             frappe.db.set_value("Advance Payment Ledger Entry", name, "docstatus", 0)
-#         except Exception:
-#             # If docstatus field doesn't exist, ignore
-#             pass
-# 
-#         frappe.delete_doc(
-#             "Advance Payment Ledger Entry",
-#             name,
-#             force=True,                 # bypass Submitted / linked-doc checks
-#             ignore_permissions=True
-#         )
-#         print(f"[{idx}/{total}] Deleted Advance Payment Ledger Entry {name}")
-# 
-#         if idx % commit_interval == 0:
-#             frappe.db.commit()
-# 
-#     # Final commit for any remaining changes
-#     frappe.db.commit()
 #     return f"Deleted {total} Advance Payment Ledger Entry rows."
 
 #--------------------------------------------
@@ -736,21 +832,24 @@ frappe.call("eseller_suite.eseller_suite.doctype.amazon_sp_api_settings.bench_fu
 #         print("No Stock Reconciliations found.")
 #         return "No Stock Reconciliations found."
 # 
-#     batch_size = 100
+#     batch_size = 5000
+#     last_name = ""
 #     deleted = 0
 #     errors = 0
 # 
 #     print(f"Found {total} {doctype} documents. Starting deletion in batches of {batch_size}...")
 # 
 #     while True:
-#         # Fetch a batch of names (and docstatus) to delete
+#         # Fetch the next page of names (and docstatus) after the last one seen;
+#         # rows that fail to delete are not fetched again
 #         rows = frappe.db.sql(
-#             "SELECT name, docstatus FROM `tabStock Reconciliation` LIMIT %s",
-#             batch_size,
+#             "SELECT name, docstatus FROM `tabStock Reconciliation` WHERE name > %s ORDER BY name LIMIT %s",
+#             (last_name, batch_size),
 #             as_dict=True,
 #         )
 #         if not rows:
 #             break
+#         last_name = rows[-1].name
 # 
 #         for row in rows:
 #             name = row.name
@@ -759,14 +858,10 @@ frappe.call("eseller_suite.eseller_suite.doctype.amazon_sp_api_settings.bench_fu
 #                 if row.docstatus != 0:
 #                     frappe.db.set_value(doctype, name, "docstatus", 0)
 # 
-#                 frappe.delete_doc(
-#                     doctype,
-#                     name,
-#                     ignore_permissions=True,
-#                     force=True,
-#                 )
+#                 frappe.delete_doc(doctype, name, **MASS_DELETE_FLAGS)
 #                 deleted += 1
-#                 print(f"[{deleted}/{total}] Deleted {doctype}: {name}")
+#                 if deleted % PROGRESS_EVERY == 0:
+#                     print(f"[{deleted}/{total}] Deleted {doctype} docs…")
 #             except Exception as e:
 #                 errors += 1
 #                 print(f"!! Error deleting {doctype} {name}: {e}")
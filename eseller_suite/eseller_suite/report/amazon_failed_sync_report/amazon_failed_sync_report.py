@@ -52,30 +52,35 @@ def get_data(filters):
     '''
         Method to get data for report
     '''
-    data  = []
     from_date = getdate(filters.get("from_date"))
     to_date = getdate(filters.get("to_date"))
     group_based_on = filters.get("group_based_on")
-    order_query = '''
+    # Range scan on the (amazon_order_date, amazon_order_id) index from setup.get_indexes
+    index_hint = ''
+    if frappe.db.has_index('tabAmazon Failed Sync Record', 'order_date_order_id_idx'):
+        index_hint = 'USE INDEX (order_date_order_id_idx)'
+    # One row per order; duplicate failed records of the same order are not summed
+    distinct_orders_query = '''
         SELECT
-            DISTINCT amazon_order_id,
-            name,
-            amazon_order_date,
-            amazon_order_amount,
-            grand_total as order_amount
+            amazon_order_id,
+            MAX(amazon_order_date) as amazon_order_date,
+            MAX(amazon_order_amount) as amazon_order_amount,
+            MAX(grand_total) as order_amount
         FROM
-            `tabAmazon Failed Sync Record`
+            `tabAmazon Failed Sync Record` {0}
         WHERE
             amazon_order_date BETWEEN %(from_date)s AND %(to_date)s
         GROUP BY
             amazon_order_id
+    '''.format(index_hint)
+    order_query = '''
+        {0}
         ORDER BY
             amazon_order_date
-    '''
+    '''.format(distinct_orders_query)
+    # Grouped on the date, so the ORDER BY needs no extra sort
     so_query = '''
         SELECT
-            amazon_order_id,
-            name,
             amazon_order_date,
             SUM(amazon_order_amount) as amazon_order_amount,
             SUM(order_amount) as order_amount
@@ -85,15 +90,13 @@ def get_data(filters):
         ) AS distinct_orders
         GROUP BY
             amazon_order_date
-    '''.format(order_query)
-    if group_based_on == 'Order ID':
-         results = frappe.db.sql(order_query, {
-            'from_date':from_date,
-            'to_date':to_date
-        }, as_dict=True)
-    else:
-        results = frappe.db.sql(so_query, {
-            'from_date':from_date,
-            'to_date':to_date
-        }, as_dict=True)
-    return results
\ No newline at end of file
+        ORDER BY
+            amazon_order_date
+    '''.format(distinct_orders_query)
+    query = order_query if group_based_on == 'Order ID' else so_query
+    # Only the bound values the query references
+    results = frappe.db.sql(query, {
+        'from_date':from_date,
+        'to_date':to_date
+    }, as_dict=True)
+    return results
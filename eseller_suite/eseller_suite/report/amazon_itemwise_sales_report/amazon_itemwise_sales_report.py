@@ -3,9 +3,14 @@
 
 import frappe
 from frappe import _
+from frappe.query_builder import Case
+from frappe.query_builder.functions import Count, Min, Sum
 from frappe.utils import flt
 from frappe.utils.nestedset import get_descendants_of
 
+# Above this many companies, filter by the Company tree range rather than by name
+MAX_COMPANY_IN_LIST = 32
+
 
 def execute(filters=None):
 	filters = frappe._dict(filters or {})
@@ -222,9 +227,16 @@ def get_data(filters):
 	company_list = get_descendants_of("Company", filters.get("company"))
 	company_list.append(filters.get("company"))
 
-	customer_details = get_customer_details()
-	item_details = get_item_details()
+	# Summary mode
+	if filters.get("summary"):
+		return get_summary_data(company_list, filters)
+
 	sales_order_records = get_sales_order_details(company_list, filters)
+	customer_details = get_customer_details({record.customer for record in sales_order_records})
+	item_details = get_item_details({record.item_code for record in sales_order_records})
+	amazon_tax_by_invoice = get_amazon_tax_amounts(
+		{record.name for record in sales_order_records if record.get("qty") < 0}
+	)
 
 	for record in sales_order_records:
 		customer_record = customer_details.get(record.customer)
@@ -232,51 +244,9 @@ def get_data(filters):
 
 		# Handle Amazon tax for returns
 		if record.get("qty") < 0:
-			amazon_tax_head = frappe.db.sql(
-				"""select name from `tabAccount` where name like 'Amazon Tax%'""",
-				as_dict=True
-			)[0]["name"]
-
-			amazon_tax = frappe.db.get_value(
-				"Sales Taxes and Charges",
-				{"parent": record.name, "account_head": amazon_tax_head},
-				"tax_amount"
-			)
+			amazon_tax = amazon_tax_by_invoice.get(record.name)
 			record["amount"] = record.get("amount", 0) + (amazon_tax or 0)
 
-		# Summary mode
-		if filters.get("summary"):
-			matched_row = next((d for d in data if d.get("item_code") == record.get("item_code")), None)
-			if not matched_row:
-				row = {
-					"item_code": record.get("item_code"),
-					"item_name": item_record.get("item_name"),
-					"item_group": item_record.get("item_group"),
-					"description": record.get("description"),
-					"uom": record.get("uom"),
-					"quantity": record.get("qty") if record.get("qty") > 0 else 0,
-					"return_quantity": abs(record.get("qty")) if record.get("qty") < 0 else 0,
-					"sales_amount": record.get("amount") if record.get("qty") > 0 else 0,
-					"returned_amount": record.get("amount") if record.get("qty") < 0 else 0,
-					"amount": record.get("amount"),
-					"net_quantity": record.get("qty"),
-					"net_amount": record.get("amount"),
-				}
-				data.append(row)
-			else:
-				if record.get("qty") < 0:
-					matched_row["return_quantity"] += abs(record.get("qty"))
-					matched_row["returned_amount"] += record.get("amount")
-					matched_row["net_quantity"] -= abs(record.get("qty"))
-					matched_row["net_amount"] += record.get("amount")
-				else:
-					matched_row["quantity"] += record.get("qty")
-					matched_row["sales_amount"] += record.get("amount")
-					matched_row["net_quantity"] += record.get("qty")
-					matched_row["net_amount"] += record.get("amount")
-					matched_row["amount"] += record.get("amount")
-			continue
-
 		# Detailed mode
 		row = {
 			"item_code": record.get("item_code"),
@@ -302,37 +272,118 @@ def get_data(filters):
 			"delivered_quantity": flt(record.get("delivered_qty")),
 			"billed_amount": flt(record.get("billed_amt")),
 			"company": record.get("company"),
-			"currency": frappe.get_cached_value("Company", record.get("company"), "default_currency"),
+			"currency": record.get("currency"),
 			"sales_amount": record.get("amount") if record.get("qty") > 0 else 0,
 			"returned_amount": record.get("amount") if record.get("qty") < 0 else 0,
 		}
 		data.append(row)
 
-	return data if not filters.get("summary") else sorted(data, key=lambda x: x.get("item_code"))
+	return data
+
 
+def get_summary_data(company_list, filters):
+	"""
+	Summary rows per item_code, built from invoice item totals already grouped in SQL.
+	Returns stay grouped per invoice so each one can carry its Amazon Tax.
+	"""
+	records = get_sales_item_summary(company_list, filters)
+	item_details = get_item_details({record.item_code for record in records})
+	amazon_tax_by_invoice = get_amazon_tax_amounts(
+		{record.return_invoice for record in records if record.return_invoice}
+	)
 
-def get_customer_details():
-	details = frappe.get_all("Customer", fields=["name", "customer_name", "customer_group"])
-	customer_details = {}
-	for d in details:
-		customer_details[d.name] = frappe._dict({"customer_name": d.customer_name, "customer_group": d.customer_group})
-	return customer_details
+	summary_map = {}
+	for record in records:
+		row = summary_map.get(record.item_code)
+		if not row:
+			item_record = item_details.get(record.item_code)
+			row = summary_map[record.item_code] = {
+				"item_code": record.item_code,
+				"item_name": item_record.get("item_name"),
+				"item_group": item_record.get("item_group"),
+				"description": record.description,
+				"uom": record.uom,
+				"quantity": 0,
+				"return_quantity": 0,
+				"sales_amount": 0,
+				"returned_amount": 0,
+				"amount": 0,
+				"net_quantity": 0,
+				"net_amount": 0,
+			}
 
-def get_item_details():
-	details = frappe.db.get_all("Item", fields=["name", "item_name", "item_group"])
-	item_details = {}
-	for d in details:
-		item_details[d.name] = frappe._dict({"item_name": d.item_name, "item_group": d.item_group})
-	return item_details
+		if record.return_invoice:
+			# Amazon Tax is added once per returned item row, as in the detailed view
+			amount = flt(record.amount) + flt(amazon_tax_by_invoice.get(record.return_invoice)) * record.row_count
+			row["return_quantity"] += abs(record.qty)
+			row["returned_amount"] += amount
+		else:
+			amount = flt(record.amount)
+			row["quantity"] += record.qty
+			row["sales_amount"] += amount
+			row["amount"] += amount
+		row["net_quantity"] += record.qty
+		row["net_amount"] += amount
+
+	# Rows were inserted in item_code order from the query
+	return list(summary_map.values())
+
+def get_customer_details(customers):
+	if not customers:
+		return {}
+	details = frappe.get_all(
+		"Customer", filters={"name": ("in", list(customers))}, fields=["name", "customer_name", "customer_group"]
+	)
+	# Rows are already frappe._dict; key them by name as they are
+	return {d.name: d for d in details}
+
+def get_item_details(item_codes):
+	if not item_codes:
+		return {}
+	details = frappe.db.get_all(
+		"Item", filters={"name": ("in", list(item_codes))}, fields=["name", "item_name", "item_group"]
+	)
+	return {d.name: d for d in details}
+
+def get_amazon_tax_amounts(invoice_names):
+	"""
+	Returns {sales invoice: Amazon Tax amount} for the given return invoices,
+	looking up the Amazon Tax account once for all of them.
+	"""
+	if not invoice_names:
+		return {}
+
+	amazon_tax_head = frappe.db.sql(
+		"""select name from `tabAccount` where name like 'Amazon Tax%'""",
+		as_dict=True
+	)[0]["name"]
+
+	tax_rows = frappe.db.sql(
+		"""
+		select parent, tax_amount
+		from `tabSales Taxes and Charges`
+		where account_head = %(account_head)s and parent in %(parents)s
+		order by idx
+		""",
+		{"account_head": amazon_tax_head, "parents": tuple(invoice_names)},
+		as_dict=True
+	)
+	amazon_tax_by_invoice = {}
+	for d in tax_rows:
+		amazon_tax_by_invoice.setdefault(d.parent, d.tax_amount)
+	return amazon_tax_by_invoice
 
 def get_sales_order_details(company_list, filters):
 	db_so = frappe.qb.DocType("Sales Invoice")
 	db_so_item = frappe.qb.DocType("Sales Invoice Item")
+	db_company = frappe.qb.DocType("Company")
 
 	query = (
 		frappe.qb.from_(db_so)
 		.inner_join(db_so_item)
 		.on(db_so_item.parent == db_so.name)
+		.left_join(db_company)
+		.on(db_company.name == db_so.company)
 		.select(
 			db_so.name,
 			db_so.amazon_order_id,
@@ -341,6 +392,7 @@ def get_sales_order_details(company_list, filters):
 			db_so.territory,
 			db_so.project,
 			db_so.company,
+			db_company.default_currency.as_("currency"),
 			db_so_item.item_code,
 			db_so_item.description,
 			db_so_item.qty,
@@ -349,10 +401,57 @@ def get_sales_order_details(company_list, filters):
 			db_so_item.delivered_qty,
 			db_so_item.amount,
 		)
-		.where(db_so.docstatus == 1)
-		.where(db_so.company.isin(tuple(company_list)))
 		.orderby(db_so.posting_date, db_so.name)
 	)
+	query = apply_filters(query, db_so, db_so_item, company_list, filters)
+
+	return query.run(as_dict=1)
+
+def get_sales_item_summary(company_list, filters):
+	"""
+	Invoice item totals per item_code: one row for all sales of the item and one row
+	per return invoice (return_invoice set), with the number of item rows summed.
+	"""
+	db_so = frappe.qb.DocType("Sales Invoice")
+	db_so_item = frappe.qb.DocType("Sales Invoice Item")
+	return_invoice = Case().when(db_so_item.qty < 0, db_so.name)
+
+	query = (
+		frappe.qb.from_(db_so)
+		.inner_join(db_so_item)
+		.on(db_so_item.parent == db_so.name)
+		.select(
+			db_so_item.item_code,
+			return_invoice.as_("return_invoice"),
+			Sum(db_so_item.qty).as_("qty"),
+			Sum(db_so_item.amount).as_("amount"),
+			Count("*").as_("row_count"),
+			Min(db_so_item.uom).as_("uom"),
+			Min(db_so_item.description).as_("description"),
+		)
+		.groupby(db_so_item.item_code, return_invoice)
+		.orderby(db_so_item.item_code)
+	)
+	query = apply_filters(query, db_so, db_so_item, company_list, filters)
+
+	return query.run(as_dict=1)
+
+def apply_filters(query, db_so, db_so_item, company_list, filters):
+	query = query.where(db_so.docstatus == 1)
+
+	if len(company_list) > MAX_COMPANY_IN_LIST:
+		# Large group: select the subtree by its lft/rgt range instead of a long IN list
+		db_company = frappe.qb.DocType("Company")
+		lft, rgt = frappe.db.get_value("Company", filters.get("company"), ["lft", "rgt"])
+		query = query.where(
+			db_so.company.isin(
+				frappe.qb.from_(db_company)
+				.select(db_company.name)
+				.where((db_company.lft >= lft) & (db_company.rgt <= rgt))
+			)
+		)
+	else:
+		query = query.where(db_so.company.isin(tuple(company_list)))
 
 	if filters.get("item_group"):
 		query = query.where(db_so_item.item_group == filters.item_group)
@@ -369,7 +468,7 @@ def get_sales_order_details(company_list, filters):
 	if filters.get("customer"):
 		query = query.where(db_so.customer == filters.customer)
 
-	return query.run(as_dict=1)
+	return query
 
 def get_chart_data(data):
 	item_wise_sales_map = {}
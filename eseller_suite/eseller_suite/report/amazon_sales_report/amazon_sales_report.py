@@ -108,7 +108,6 @@ def get_data(filters):
     """
     Method to get data for the report.
     """
-    data = []
     from_date = getdate(filters.get("from_date"))
     to_date = getdate(filters.get("to_date"))
     group_based_on = filters.get("group_based_on", "transaction_date")
@@ -118,10 +117,11 @@ def get_data(filters):
     else:
         group_based_on = "transaction_date"
 
-    # Optimized query with joins for invoice, return, and cancel sums
+    # Invoice, return and cancelled sums are aggregated per amazon_order_id before the
+    # join, so orders with several invoices/returns do not multiply each other's rows.
+    # Only orders that have a Sales Order in the date range are aggregated.
     so_query = """
         SELECT
-            s.name,
             s.transaction_date,
             s.amazon_order_id,
             s.amazon_customer_type AS customer_type,
@@ -129,17 +129,49 @@ def get_data(filters):
             s.fulfillment_channel,
             SUM(s.amazon_order_amount) AS amazon_order_amount,
             SUM(s.grand_total) AS order_amount,
-            IFNULL(SUM(i.grand_total), 0) AS invoice_amount,
-            IFNULL(SUM(r.grand_total), 0) AS return_amount,
-            IFNULL(SUM(c.grand_total), 0) AS cancelled_amount
+            IFNULL(SUM(i.invoice_amount), 0) AS invoice_amount,
+            IFNULL(SUM(i.return_amount), 0) AS return_amount,
+            IFNULL(SUM(c.cancelled_amount), 0) AS cancelled_amount,
+            SUM(s.amazon_order_amount) - IFNULL(SUM(i.return_amount), 0)
+                - IFNULL(SUM(c.cancelled_amount), 0) AS total_order_amount,
+            SUM(s.grand_total) - IFNULL(SUM(i.return_amount), 0)
+                - IFNULL(SUM(c.cancelled_amount), 0) AS total_amount
         FROM
             `tabSales Order` s
         LEFT JOIN
-            `tabSales Invoice` i ON i.amazon_order_id = s.amazon_order_id AND i.is_return = 0 AND i.docstatus != 2
+        (
+            SELECT
+                amazon_order_id,
+                SUM(CASE WHEN is_return = 0 THEN grand_total ELSE 0 END) AS invoice_amount,
+                SUM(CASE WHEN is_return = 1 THEN grand_total ELSE 0 END) AS return_amount
+            FROM
+                `tabSales Invoice`
+            WHERE
+                docstatus != 2
+                AND amazon_order_id IN (
+                    SELECT amazon_order_id FROM `tabSales Order`
+                    WHERE transaction_date BETWEEN %(from_date)s AND %(to_date)s
+                )
+            GROUP BY
+                amazon_order_id
+        ) i ON i.amazon_order_id = s.amazon_order_id
         LEFT JOIN
-            `tabSales Invoice` r ON r.amazon_order_id = s.amazon_order_id AND r.is_return = 1 AND r.docstatus != 2
-        LEFT JOIN
-            `tabSales Order` c ON c.amazon_order_id = s.amazon_order_id AND c.amazon_order_status = 'Canceled' AND c.docstatus != 2
+        (
+            SELECT
+                amazon_order_id,
+                SUM(grand_total) AS cancelled_amount
+            FROM
+                `tabSales Order`
+            WHERE
+                amazon_order_status = 'Canceled'
+                AND docstatus != 2
+                AND amazon_order_id IN (
+                    SELECT amazon_order_id FROM `tabSales Order`
+                    WHERE transaction_date BETWEEN %(from_date)s AND %(to_date)s
+                )
+            GROUP BY
+                amazon_order_id
+        ) c ON c.amazon_order_id = s.amazon_order_id
         WHERE
             s.transaction_date BETWEEN %(from_date)s AND %(to_date)s
     """
@@ -161,7 +193,7 @@ def get_data(filters):
         group_based_on
     )
 
-    results = frappe.db.sql(
+    return frappe.db.sql(
         so_query,
         {
             "from_date": from_date,
@@ -171,14 +203,3 @@ def get_data(filters):
         },
         as_dict=True,
     )
-
-    for row in results:
-        row["total_order_amount"] = (
-            row["amazon_order_amount"] - row["return_amount"] - row["cancelled_amount"]
-        )
-        row["total_amount"] = (
-            row["order_amount"] - row["return_amount"] - row["cancelled_amount"]
-        )
-        data.append(row)
-
-    return data
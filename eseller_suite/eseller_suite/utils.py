@@ -1,17 +1,14 @@
-from datetime import datetime
-from pytz import timezone
+from datetime import datetime, timedelta, timezone
 
-def format_date_time_to_ist(utc_time_str):
-    # Parse the UTC time string
-    utc_time = datetime.strptime(utc_time_str, '%Y-%m-%dT%H:%M:%SZ')
-
-    # Convert to IST
-    utc_zone = timezone('UTC')
-    ist_zone = timezone('Asia/Kolkata')
+# IST has no DST, so a fixed offset from UTC is exact
+IST = timezone(timedelta(hours=5, minutes=30))
 
-    # Localize the UTC time
-    utc_time = utc_zone.localize(utc_time)
+def format_date_time_to_ist(utc_time_str):
+    # Parse the UTC time string ('%Y-%m-%dT%H:%M:%SZ'); only a literal trailing 'Z' means UTC
+    utc_time = datetime.fromisoformat(utc_time_str.removesuffix("Z"))
+    if utc_time.tzinfo is None:
+        utc_time = utc_time.replace(tzinfo=timezone.utc)
 
     # Convert to IST
-    ist_time = utc_time.astimezone(ist_zone)
+    ist_time = utc_time.astimezone(IST)
     return ist_time.strftime('%Y-%m-%d %H:%M:%S')
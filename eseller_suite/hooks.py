@@ -137,6 +137,10 @@ doc_events = {
     "Journal Entry": {
         "on_submit": "eseller_suite.eseller_suite.doctype.amazon_sp_api_settings.amazon_process_settlement_report.shorten_remarks",
     },
+    "Item": {
+        "on_update": "eseller_suite.eseller_suite.doctype.amazon_sp_api_settings.amazon_sync_fba_inventory.clear_asin_cache",
+        "on_trash": "eseller_suite.eseller_suite.doctype.amazon_sp_api_settings.amazon_sync_fba_inventory.clear_asin_cache",
+    },
 #    'Sales Invoice':{
 #        "validate": "eseller_suite.eseller_suite.custom_script.sales_invoice.sales_invoice.validate",
 #        "before_submit": "eseller_suite.eseller_suite.custom_script.sales_invoice.sales_invoice.before_submit",
@@ -168,7 +172,7 @@ scheduler_events = {
     "hourly_long": [
         "eseller_suite.eseller_suite.doctype.amazon_sp_api_settings.amazon_sp_api_settings.schedule_get_order_details",                   # Amazon Orders Sync: Import Amazon orders from the current day (goes back to midnight from the night before)
         "eseller_suite.eseller_suite.doctype.amazon_sp_api_settings.amazon_process_settlement_report.create_clearing_payment_entries",    # Amazon Settlement Clearing: Check for & create clearing payment entries (transfering from amazon clearing to bank of america)
-        "eseller_suite.eseller_suite.doctype.amazon_sp_api_settings.amazon_sync_fba_inventory.run_daily_fba_inventory_sync",              # Amazon FBA Inventory Sync: Import/update Amazon FBA inventory & Amazon Inbound inventory by creating stock reconciliation entries and material transfer entries. Runs at 8am daily
+        "eseller_suite.eseller_suite.doctype.amazon_sp_api_settings.amazon_sync_fba_inventory.run_daily_fba_inventory_sync",              # Amazon FBA Inventory Sync: Import/update Amazon FBA inventory & Amazon Inbound inventory by creating stock reconciliation entries and material transfer entries. Runs at 7am PST daily
         "eseller_suite.eseller_suite.doctype.amazon_sp_api_settings.amazon_pay_process_settlement_report.process_settlement_reports"      # Amazon Pay Clearing: Transfers funds from the Amazon Pay Clearing Account to the default bank account & creates a journal entry with the fees. Runs at 1am daily    
     ],
 #     "weekly": [
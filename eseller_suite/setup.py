@@ -1,32 +1,107 @@
+import hashlib
+import json
+from functools import cache
+
 import frappe
 from frappe import _
-from frappe.custom.doctype.custom_field.custom_field import create_custom_fields
+from frappe.utils import cstr
+
+SETUP_HASH_KEY = "eseller_suite_setup_hash"
 
 def after_install():
-	create_custom_fields(get_item_custom_fields(), ignore_validate=True)
-	create_custom_fields(get_sales_order_custom_fields(), ignore_validate=True)
-	create_custom_fields(get_sales_invoice_custom_fields(), ignore_validate=True)
-	create_custom_fields(get_purchase_invoice_custom_fields(), ignore_validate=True)
-	create_custom_fields(get_journal_entry_custom_fields(), ignore_validate=True)
-	create_custom_fields(get_purchase_receipt_custom_fields(), ignore_validate=True)
-	create_custom_fields(get_stock_entry_custom_fields(), ignore_validate=True)
+	from frappe.custom.doctype.custom_field.custom_field import create_custom_fields
+
+	# One commit for the whole setup; the hash is only stored if everything went through.
+	# (Columns added by create_custom_fields are DDL and commit implicitly in MariaDB.)
+	try:
+		create_custom_fields(get_custom_fields(), ignore_validate=True)
+
+		# Creating Property setters
+		create_property_setters(get_property_setters())
 
-	# Creating Property setters
-	create_property_setters(get_purchase_receipt_item_property_setters())
-	create_property_setters(get_stock_entry_detail_property_setters())
-	create_property_setters(get_stock_entry_property_setters())
-	create_property_setters(get_item_property_setters())
+		frappe.db.set_default(SETUP_HASH_KEY, get_setup_hash())
+		frappe.db.commit()
+	except Exception:
+		frappe.db.rollback()
+		raise
 
 def after_migrate():
-	after_install()
+	# Custom fields and property setters only need re-applying when their definitions change.
+	# Set `skip_eseller_custom_fields` in site config to skip them on every migrate.
+	if not frappe.conf.get("skip_eseller_custom_fields") and frappe.db.get_default(SETUP_HASH_KEY) != get_setup_hash():
+		after_install()
+	create_indexes()
+
+@cache
+def get_setup_hash():
+	'''
+		Fingerprint of the custom field and property setter definitions.
+		The definitions are fixed for the life of the process, so it is only encoded once.
+	'''
+	return hashlib.blake2b(
+		json.dumps(
+			[get_custom_fields(), get_property_setters()], sort_keys=True, separators=(",", ":"), default=str
+		).encode(),
+		digest_size=16,
+	).hexdigest()
+
+def get_property_setters():
+	return (
+		get_purchase_receipt_item_property_setters()
+		+ get_stock_entry_detail_property_setters()
+		+ get_stock_entry_property_setters()
+		+ get_item_property_setters()
+	)
+
+def create_indexes():
+	'''
+		Method to add the composite indexes eSeller Suite queries rely on.
+		Indexes over site-level custom fields are skipped until the column exists.
+	'''
+	for doctype, fields, index_name in get_indexes():
+		if all(frappe.db.has_column(doctype, field) for field in fields):
+			frappe.db.add_index(doctype, fields, index_name)
+
+def get_indexes():
+	'''
+		Composite indexes as (doctype, fields, index_name)
+	'''
+	return [
+		# FBA inventory sync: stocked Amazon items per warehouse
+		("Item", ["custom_asin", "disabled", "is_stock_item"], "asin_stock_idx"),
+		# FBA inventory sync: serial nos on hand per item in the prep area
+		("Serial No", ["item_code", "warehouse"], "item_code_warehouse_idx"),
+		# Amazon Failed Sync Report: date range filter grouped per order
+		("Amazon Failed Sync Record", ["amazon_order_date", "amazon_order_id"], "order_date_order_id_idx"),
+		# Amazon Sales Report: invoice/return sums per order
+		("Sales Invoice", ["amazon_order_id", "is_return", "docstatus"], "amazon_order_return_idx"),
+		# Amazon Sales Report: cancelled order sums per order
+		("Sales Order", ["amazon_order_id", "amazon_order_status"], "amazon_order_status_idx"),
+		# Amazon Itemwise Sales Report: invoice items per invoice and item
+		("Sales Invoice Item", ["parent", "item_code"], "parent_item_code_idx"),
+		# Temporary stock transfer cleanup: transfers into a warehouse, and the orders linking them
+		("Stock Entry Detail", ["t_warehouse", "parent"], "t_warehouse_parent_idx"),
+		("Sales Order", ["temporary_stock_tranfer_id"], "temporary_stock_tranfer_id_idx"),
+	]
 
 def before_uninstall():
-	delete_custom_fields(get_item_custom_fields())
-	delete_custom_fields(get_sales_order_custom_fields())
-	delete_custom_fields(get_sales_invoice_custom_fields())
-	delete_custom_fields(get_purchase_invoice_custom_fields())
-	delete_custom_fields(get_journal_entry_custom_fields())
-	delete_custom_fields(get_purchase_receipt_custom_fields())
+	delete_custom_fields(get_custom_fields())
+
+def get_custom_fields():
+	'''
+		All eSeller Suite custom fields as one `{doctype: [fields]}` dict.
+		Install and uninstall both read this, so the two can not drift apart.
+	'''
+	# Every getter covers its own doctypes, so a plain union loses no fields
+	return (
+		get_item_custom_fields()
+		| get_sales_order_custom_fields()
+		| get_sales_invoice_custom_fields()
+		| get_purchase_invoice_custom_fields()
+		| get_journal_entry_custom_fields()
+		| get_purchase_receipt_custom_fields()
+		| get_stock_entry_custom_fields()
+	)
 
 def delete_custom_fields(custom_fields: dict):
 	'''
@@ -34,14 +109,18 @@ def delete_custom_fields(custom_fields: dict):
 		args:
 			custom_fields: a dict like `{'Sales Order': [{fieldname: 'amazon_order_id', ...}]}`
 	'''
-	for doctype, fields in custom_fields.items():
-		frappe.db.delete(
-			"Custom Field",
-			{
-				"fieldname": ("in", [field["fieldname"] for field in fields]),
-				"dt": doctype,
-			},
-		)
+	# Custom Field names are `{dt}-{fieldname}`, so one primary key lookup covers every doctype
+	frappe.db.delete(
+		"Custom Field",
+		{
+			"name": ("in", [
+				f"{doctype}-{field['fieldname']}"
+				for doctype, fields in custom_fields.items()
+				for field in fields
+			]),
+		},
+	)
+	for doctype in custom_fields:
 		frappe.clear_cache(doctype=doctype)
 
 def get_item_custom_fields():
@@ -534,13 +613,39 @@ def create_property_setters(property_setter_datas):
 		args:
 			property_setter_datas : list of dict of property setter obj
 	'''
-	for property_setter_data in property_setter_datas:
-		if frappe.db.exists("Property Setter", property_setter_data):
-			continue
-		property_setter = frappe.new_doc("Property Setter")
-		property_setter.update(property_setter_data)
-		property_setter.flags.ignore_permissions = True
-		property_setter.insert()
+	key_fields = ["doctype_or_field", "doc_type", "field_name", "property", "value"]
+	existing = {
+		tuple(cstr(value) for value in row)
+		for row in frappe.get_all(
+			"Property Setter",
+			filters={"doc_type": ("in", list({d["doc_type"] for d in property_setter_datas}))},
+			fields=key_fields,
+			as_list=True,
+		)
+	}
+	missing = [
+		d for d in property_setter_datas
+		if tuple(cstr(d.get(field)) for field in key_fields) not in existing
+	]
+	if not missing:
+		return
+
+	# Static, trusted rows: write them in one INSERT instead of one document insert each.
+	# Names follow Property Setter.autoname; a setter with an outdated value is replaced,
+	# as a document insert would do.
+	now, user = frappe.utils.now(), frappe.session.user or "Administrator"
+	rows = []
+	for d in missing:
+		name = f"{d['doc_type']}-{d.get('field_name') or 'main'}-{d['property']}"
+		rows.append((name, now, now, user, user, *(cstr(d.get(field)) for field in key_fields)))
+	frappe.db.delete("Property Setter", {"name": ("in", [row[0] for row in rows])})
+	frappe.db.bulk_insert(
+		"Property Setter",
+		fields=["name", "creation", "modified", "owner", "modified_by", *key_fields],
+		values=rows,
+	)
+	for doctype in {d["doc_type"] for d in missing}:
+		frappe.clear_cache(doctype=doctype)
 
 def get_purchase_receipt_item_property_setters():
     return [